@@ -1,17 +1,43 @@
 import os
-import time
+import sys
+import argparse
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import aiohttp
-from bs4 import BeautifulSoup
+import aiofiles
+import aiofiles.os
+import lxml.html
+from lxml import etree
 import re
-from urllib.parse import urljoin
+import hashlib
+import functools
+from urllib.parse import urljoin, urlsplit
 from typing import List, Dict, Optional, Set, Tuple
 import logging
 import json
 from pathlib import Path
 import random
+import time
 from datetime import datetime
 
+# uvloop为可选依赖，安装后使用基于libuv的事件循环
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# aiohttp只有在安装了brotli（或brotlicffi）时才能解压br编码的响应
+try:
+    import brotli  # noqa: F401
+    _HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        _HAS_BROTLI = True
+    except ImportError:
+        _HAS_BROTLI = False
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +45,70 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 预编译的XPath表达式，直接在libxml2中完成节点定位
+# 列表页：帖子表格中至少有3列的行，取第2个td（标题单元格）里href非空的第一个链接
+LIST_XPATH = etree.XPath('//table[contains(@class, "board-list")]//tr[count(td) >= 3]/td[2]/descendant::a[1][normalize-space(@href)]')
+# 详情页：相对于某个表格，取其第2行中的第2个单元格作为正文候选
+DETAIL_CELL_XPATH = etree.XPath('((.//tr)[2]//td)[2]')
+
+# 正文中的图片占位符，序号对应帖子中图片的位置
+_PLACEHOLDER_RE = re.compile(r'__IMG_PLACEHOLDER_(\d+)__')
+# 链接开头的URL协议，如 http:、data:、javascript:
+_URL_SCHEME_RE = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*:')
+
+# 换行及其两侧的空白（含连续空行），用于一次性规范化段落
+_CLEAN_NL_RE = re.compile(r'\s*\n\s*')
+
+# 行内连续的空格和制表符，压缩为一个空格
+_WS_RE = re.compile(r'[ \t]+')
+
+# 文件名中的非法字符替换表，str.translate逐字符替换比正则更快
+_ILLEGAL_FN_TABLE = str.maketrans({c: '_' for c in '\\/*?:"<>|'})
+
+@functools.lru_cache(maxsize=8192)
+def _safe_filename(title: str) -> str:
+    """把标题转换为安全的文件名，重复爬取同一列表页时直接命中缓存"""
+    return title.translate(_ILLEGAL_FN_TABLE)
+
+class _RateLimiter:
+    """所有请求共享的令牌桶限速器，服务端限流或出错时整体指数退避"""
+
+    def __init__(self, rate: float, max_backoff: float = 30.0):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.max_backoff = max_backoff
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff = 0.0
+        # 等待令牌的请求依次排队，避免同时醒来争抢
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """等待一个令牌"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def record(self, status: int):
+        """根据响应状态调整退避：429和5xx时退避时间翻倍并加随机抖动，成功后清零"""
+        if status == 429 or status >= 500:
+            self._backoff = min(self._backoff * 2 or 0.5, self.max_backoff)
+            pause = self._backoff * random.uniform(0.5, 1.5)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            logger.warning("Server returned %s, backing off %.1fs", status, pause)
+        else:
+            self._backoff = 0.0
+
 class ShuimuCrawler:
     # 搜索引擎爬虫的User-Agent列表
     USER_AGENTS = [
@@ -35,42 +125,93 @@ class ShuimuCrawler:
         'Mozilla/5.0 (compatible; 360Spider/1.0; +http://www.so.com/help/help_3_2.html)'
     ]
 
-    def __init__(self, save_dir='./data', max_concurrency=20):
+    # 搜索引擎爬虫的固定请求头，作为会话默认请求头只设置一次
+    DEFAULT_HEADERS = {
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5,zh-CN;q=0.3',
+        'Accept-Encoding': 'gzip, deflate, br' if _HAS_BROTLI else 'gzip, deflate',
+        'Connection': 'keep-alive',
+        'From': 'googlebot(at)googlebot.com',  # 搜索引擎联系方式
+        'Cache-Control': 'no-cache',
+        'Pragma': 'no-cache'
+    }
+
+    def __init__(self, save_dir='./data', max_concurrency=20, rate_limit=20.0):
         self.base_url = 'https://www.newsmth.net'
+        # base_url不含路径，站内链接直接拼接即可，不必每次调用urljoin解析两个URL
+        self._base_url_root = self.base_url.rstrip('/')
         self.board_url = 'https://www.newsmth.net/nForum/board/OurEstate'
         self.save_dir = save_dir
         self.max_concurrency = max_concurrency
-        self.semaphore = asyncio.Semaphore(max_concurrency)
-        self.cookies = {}  # 存储cookies
+        # 限制每秒请求数，避免突发请求触发服务端限流导致大量重试
+        self._limiter = _RateLimiter(rate_limit)
+        # 预先为每个User-Agent构建好请求头，每次请求只需随机挑选一个
+        self._header_variants = [self._build_headers(ua) for ua in self.USER_AGENTS]
+        self._image_header_variants = [
+            {**headers, 'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8'}
+            for headers in self._header_variants
+        ]
         
         # 创建robots.txt解析器
         self.robots_parser = None
         
+        # HTML解析在线程池中进行，避免CPU密集的解析阻塞事件循环
+        self._exec = ThreadPoolExecutor(max_workers=os.cpu_count())
+        # lxml解析器不能跨线程共享，每个解析线程复用自己的解析器
+        self._parser_local = threading.local()
+        
         # 创建保存目录
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+        os.makedirs(save_dir, exist_ok=True)
             
         # 创建图片保存目录
         self.images_dir = os.path.join(save_dir, 'images')
-        if not os.path.exists(self.images_dir):
-            os.makedirs(self.images_dir)
+        os.makedirs(self.images_dir, exist_ok=True)
             
         # 创建状态目录
         self.state_dir = os.path.join(save_dir, '.state')
-        if not os.path.exists(self.state_dir):
-            os.makedirs(self.state_dir)
+        os.makedirs(self.state_dir, exist_ok=True)
+        
+        # 已创建的帖子图片目录，避免每张图片都检查一次目录
+        self._created_dirs: Set[str] = set()
+            
+        # 已下载文件索引，每行一个JSON编码的标题
+        self.downloaded_index = os.path.join(self.state_dir, 'downloaded.jsonl')
             
         # 初始化已下载和失败的记录
         self.downloaded_files = self._load_downloaded_files()
         self.failed_posts = self._load_failed_items('failed_posts.json')
         self.failed_images = self._load_failed_items('failed_images.json')
+        # 失败记录只在内存中标记为脏，由后台任务定期批量写盘
+        self._failed_dirty = {'posts': False, 'images': False}
+        self._failed_flush_interval = 2.0
         
-        logger.info(f"Found {len(self.downloaded_files)} downloaded files")
-        logger.info(f"Found {len(self.failed_posts)} failed posts")
-        logger.info(f"Found {len(self.failed_images)} failed images")
+        logger.info("Found %s downloaded files", len(self.downloaded_files))
+        logger.info("Found %s failed posts", len(self.failed_posts))
+        logger.info("Found %s failed images", len(self.failed_images))
 
     def _load_downloaded_files(self) -> Set[str]:
-        """加载已下载的文件列表"""
+        """加载已下载的文件列表，优先读取索引文件，索引不存在时才扫描保存目录"""
+        if os.path.exists(self.downloaded_index):
+            downloaded = set()
+            entries = 0
+            try:
+                with open(self.downloaded_index, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        entries += 1
+                        try:
+                            downloaded.add(json.loads(line))
+                        except json.JSONDecodeError:
+                            # 中断写入可能留下不完整的行
+                            continue
+            except Exception as e:
+                logger.error("Error loading downloaded index: %s", e)
+                return downloaded
+            
+            # 索引中有重复或损坏的行时重写压缩
+            if entries != len(downloaded):
+                self._write_downloaded_index(downloaded)
+            return downloaded
+
         downloaded = set()
         if os.path.exists(self.save_dir):
             for filename in os.listdir(self.save_dir):
@@ -78,8 +219,28 @@ class ShuimuCrawler:
                     # 去掉.md后缀，获取原始标题
                     title = filename[:-3]
                     downloaded.add(title)
+        self._write_downloaded_index(downloaded)
         return downloaded
 
+    def _write_downloaded_index(self, downloaded: Set[str]):
+        """重写整个已下载文件索引"""
+        tmp_path = self.downloaded_index + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for title in downloaded:
+                    f.write(json.dumps(title, ensure_ascii=False) + '\n')
+            os.replace(tmp_path, self.downloaded_index)
+        except Exception as e:
+            logger.error("Error saving downloaded index: %s", e)
+
+    def _append_downloaded_index(self, title: str):
+        """向已下载文件索引追加一条记录"""
+        try:
+            with open(self.downloaded_index, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(title, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logger.error("Error updating downloaded index: %s", e)
+
     def _load_failed_items(self, filename: str) -> Dict:
         """加载失败的项目记录"""
         filepath = os.path.join(self.state_dir, filename)
@@ -88,18 +249,43 @@ class ShuimuCrawler:
                 with open(filepath, 'r', encoding='utf-8') as f:
                     return json.load(f)
             except Exception as e:
-                logger.error(f"Error loading {filename}: {str(e)}")
+                logger.error("Error loading %s: %s", filename, e)
                 return {}
         return {}
 
-    def _save_failed_items(self, items: Dict, filename: str):
-        """保存失败的项目记录"""
+    def _save_failed_items(self, data: str, filename: str):
+        """保存失败的项目记录，先写临时文件再原子替换，避免中断时留下半个文件"""
         filepath = os.path.join(self.state_dir, filename)
+        tmp_path = filepath + '.tmp'
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(items, f, ensure_ascii=False, indent=2)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, filepath)
         except Exception as e:
-            logger.error(f"Error saving {filename}: {str(e)}")
+            logger.error("Error saving %s: %s", filename, e)
+
+    async def _flush_failed_items(self):
+        """把有变更的失败记录写入磁盘"""
+        loop = asyncio.get_running_loop()
+        for kind, items, filename in (
+            ('posts', self.failed_posts, 'failed_posts.json'),
+            ('images', self.failed_images, 'failed_images.json'),
+        ):
+            if not self._failed_dirty[kind]:
+                continue
+            self._failed_dirty[kind] = False
+            # 在事件循环中序列化得到一致的快照，写盘放到线程池中进行
+            data = json.dumps(items, ensure_ascii=False, indent=2)
+            await loop.run_in_executor(None, self._save_failed_items, data, filename)
+
+    async def _failed_items_writer(self, stop: asyncio.Event):
+        """定期写入失败记录，stop被设置后再写入一次并退出"""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self._failed_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush_failed_items()
 
     def _add_failed_post(self, post: Dict, error: str):
         """添加失败的帖子记录"""
@@ -108,7 +294,7 @@ class ShuimuCrawler:
             'error': error,
             'timestamp': datetime.now().isoformat()
         }
-        self._save_failed_items(self.failed_posts, 'failed_posts.json')
+        self._failed_dirty['posts'] = True
 
     def _add_failed_image(self, image_url: str, post_id: str, error: str):
         """添加失败的图片记录"""
@@ -118,36 +304,35 @@ class ShuimuCrawler:
             'error': error,
             'timestamp': datetime.now().isoformat()
         }
-        self._save_failed_items(self.failed_images, 'failed_images.json')
+        self._failed_dirty['images'] = True
 
     def _remove_failed_post(self, url: str):
         """移除已成功的帖子记录"""
         if url in self.failed_posts:
             del self.failed_posts[url]
-            self._save_failed_items(self.failed_posts, 'failed_posts.json')
+            self._failed_dirty['posts'] = True
 
     def _remove_failed_image(self, url: str):
         """移除已成功的图片记录"""
         if url in self.failed_images:
             del self.failed_images[url]
-            self._save_failed_items(self.failed_images, 'failed_images.json')
-
-    def _get_random_headers(self) -> Dict[str, str]:
-        """获取随机的搜索引擎爬虫请求头"""
-        # 获取随机User-Agent
-        user_agent = random.choice(self.USER_AGENTS)
-        
-        # 搜索引擎爬虫的特殊请求头
-        headers = {
-            'User-Agent': user_agent,
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5,zh-CN;q=0.3',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'From': 'googlebot(at)googlebot.com',  # 搜索引擎联系方式
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache'
-        }
+            self._failed_dirty['images'] = True
+
+    def _absolute_url(self, link: str) -> str:
+        """把站内链接转换为完整URL"""
+        if link.startswith('//'):
+            return 'https:' + link
+        if link.startswith('/'):
+            return self._base_url_root + link
+        # 带协议的链接（http:、data:、javascript:等）原样返回，其余相对链接交给urljoin处理
+        if _URL_SCHEME_RE.match(link):
+            return link
+        return urljoin(self.base_url, link)
+
+    @staticmethod
+    def _build_headers(user_agent: str) -> Dict[str, str]:
+        """构建指定User-Agent的搜索引擎爬虫请求头（固定部分由会话的默认请求头提供）"""
+        headers = {'User-Agent': user_agent}
         
         # 如果是Googlebot，添加特殊的Chrome请求头
         if 'Googlebot' in user_agent:
@@ -155,49 +340,71 @@ class ShuimuCrawler:
                 'X-Robots-Tag': 'noarchive',  # 表明遵守robots规则
                 'AdsBot-Google': '(+http://www.google.com/adsbot.html)'
             })
-        
-        # 添加cookies如果有的话
-        if self.cookies:
-            headers['Cookie'] = '; '.join([f'{k}={v}' for k, v in self.cookies.items()])
-            
         return headers
 
+    def _get_random_headers(self, image: bool = False) -> Dict[str, str]:
+        """获取随机的请求头，返回的字典在各请求间共享，调用方不能修改"""
+        return random.choice(self._image_header_variants if image else self._header_variants)
+
     async def _init_session(self, session: aiohttp.ClientSession):
-        """初始化会话，访问主页获取必要的cookies和robots.txt"""
-        try:
-            # 首先获取robots.txt
+        """初始化会话，并发访问robots.txt、主页和版面获取必要的cookies"""
+        async def fetch_robots():
             robots_url = urljoin(self.base_url, '/robots.txt')
+            await self._limiter.acquire()
             async with session.get(robots_url, headers=self._get_random_headers()) as response:
+                self._limiter.record(response.status)
                 if response.status == 200:
                     logger.info("Successfully fetched robots.txt")
                 else:
                     logger.warning("Could not fetch robots.txt")
-            
-            # 访问主页获取初始cookies
-            async with session.get(self.base_url, headers=self._get_random_headers()) as response:
-                self.cookies.update(response.cookies)
-                await response.text()
-            
-            # 访问版面获取额外cookies
-            async with session.get(self.board_url, headers=self._get_random_headers()) as response:
-                self.cookies.update(response.cookies)
-                await response.text()
-                
-        except Exception as e:
-            logger.error(f"Error initializing session: {str(e)}")
 
-    async def get_page_content(self, session: aiohttp.ClientSession, url: str) -> Optional[str]:
-        """获取页面内容"""
+        async def fetch_cookies(url: str):
+            await self._limiter.acquire()
+            async with session.get(url, headers=self._get_random_headers()) as response:
+                self._limiter.record(response.status)
+                await response.read()
+
+        # 三个请求互不依赖，并发发出以免串行等待多个往返
+        results = await asyncio.gather(
+            fetch_robots(),
+            fetch_cookies(self.base_url),
+            fetch_cookies(self.board_url),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Error initializing session: %s", result)
+
+    def _get_parser(self, encoding: Optional[str] = None) -> lxml.html.HTMLParser:
+        """获取当前线程的HTML解析器，跳过注释/处理指令和ID索引等用不到的功能
+        
+        encoding为None时由libxml2根据页面的<meta charset>自行解码
+        """
+        parsers = getattr(self._parser_local, 'parsers', None)
+        if parsers is None:
+            parsers = self._parser_local.parsers = {}
+        parser = parsers.get(encoding)
+        if parser is None:
+            parser = lxml.html.HTMLParser(
+                encoding=encoding,
+                remove_comments=True,
+                remove_pis=True,
+                collect_ids=False
+            )
+            parsers[encoding] = parser
+        return parser
+
+    async def get_page_content(self, session: aiohttp.ClientSession, url: str) -> Optional[bytes]:
+        """获取页面原始内容，由lxml解析器直接解码"""
         try:
-            async with self.semaphore:  # 使用信号量限制并发
-                headers = self._get_random_headers()
-                timeout = aiohttp.ClientTimeout(total=10)  # 减少超时时间到10秒
-                async with session.get(url, headers=headers, timeout=timeout) as response:
-                    self.cookies.update(response.cookies)
-                    content = await response.text(encoding='gbk', errors='ignore')
-                    return content
+            headers = self._get_random_headers()
+            await self._limiter.acquire()
+            async with session.get(url, headers=headers) as response:
+                self._limiter.record(response.status)
+                content = await response.read()
+                return content
         except Exception as e:
-            logger.error(f"Error fetching {url}: {str(e)}")
+            logger.error("Error fetching %s: %s", url, e)
             return None
 
     async def download_image(self, session: aiohttp.ClientSession, image_url: str, post_id: str) -> Optional[str]:
@@ -206,53 +413,64 @@ class ShuimuCrawler:
         retry_delay = 0.5  # 减少重试延迟
         
         try:
+            # 与重试无关的准备工作只做一次
+            image_url = self._absolute_url(image_url)
+
+            post_images_dir = os.path.join(self.images_dir, post_id)
+            if post_id not in self._created_dirs:
+                await aiofiles.os.makedirs(post_images_dir, exist_ok=True)
+                self._created_dirs.add(post_id)
+
+            # 以URL的哈希作为文件名：同名图片（如1.jpg）不会互相覆盖，
+            # 同一URL每次得到相同的文件名，已下载的图片可以直接跳过
+            ext = os.path.splitext(urlsplit(image_url).path)[1] or '.jpg'
+            image_filename = hashlib.sha1(image_url.encode('utf-8')).hexdigest()[:16] + ext
+            
+            image_path = os.path.join(post_images_dir, image_filename)
+            
+            if await aiofiles.os.path.exists(image_path):
+                self._remove_failed_image(image_url)
+                return os.path.relpath(image_path, self.save_dir)
+
+            headers = self._get_random_headers(image=True)
+            chunk_size = 64 * 1024  # 64KB chunks
+            tmp_path = image_path + '.part'
+            
             for attempt in range(max_retries):
                 try:
-                    if not image_url.startswith(('http://', 'https://')):
-                        image_url = urljoin(self.base_url, image_url)
-
-                    post_images_dir = os.path.join(self.images_dir, post_id)
-                    if not os.path.exists(post_images_dir):
-                        os.makedirs(post_images_dir)
-
-                    image_filename = os.path.basename(image_url)
-                    if not image_filename or '.' not in image_filename:
-                        image_filename = f"image_{int(time.time() * 1000)}.jpg"
-                    
-                    image_path = os.path.join(post_images_dir, image_filename)
-                    
-                    if os.path.exists(image_path):
-                        self._remove_failed_image(image_url)
-                        return os.path.relpath(image_path, self.save_dir)
-
-                    async with self.semaphore:
-                        timeout = aiohttp.ClientTimeout(total=10)  # 减少超时时间到10秒
-                        headers = self._get_random_headers()
-                        headers['Accept'] = 'image/webp,image/apng,image/*,*/*;q=0.8'
-                        
-                        async with session.get(image_url, headers=headers, timeout=timeout) as response:
-                            if response.status == 200:
-                                image_data = bytearray()
-                                chunk_size = 16384  # 增加到16KB chunks
-                                
-                                async for chunk in response.content.iter_chunked(chunk_size):
-                                    image_data.extend(chunk)
+                    await self._limiter.acquire()
+                    async with session.get(image_url, headers=headers) as response:
+                        self._limiter.record(response.status)
+                        if response.status == 200:
+                            # 边接收边写入临时文件，下载完整后再原子替换，
+                            # 避免整张图片驻留内存，也不会留下写了一半的文件
+                            received = 0
+                            try:
+                                async with aiofiles.open(tmp_path, 'wb') as f:
+                                    async for chunk in response.content.iter_chunked(chunk_size):
+                                        await f.write(chunk)
+                                        received += len(chunk)
                                 
                                 content_length = response.headers.get('Content-Length')
-                                if content_length and len(image_data) != int(content_length):
+                                if content_length and received != int(content_length):
                                     raise aiohttp.ClientError("Incomplete download: size mismatch")
                                 
-                                with open(image_path, 'wb') as f:
-                                    f.write(image_data)
-                                logger.info(f"Downloaded image: {image_filename}")
-                                self._remove_failed_image(image_url)
-                                return os.path.relpath(image_path, self.save_dir)
-                            else:
-                                if attempt < max_retries - 1:
-                                    continue
-                                error_msg = f"Failed to download image, status: {response.status}"
-                                self._add_failed_image(image_url, post_id, error_msg)
-                                return None
+                                await aiofiles.os.replace(tmp_path, image_path)
+                            except BaseException:
+                                try:
+                                    os.remove(tmp_path)
+                                except OSError:
+                                    pass
+                                raise
+                            logger.info("Downloaded image: %s", image_filename)
+                            self._remove_failed_image(image_url)
+                            return os.path.relpath(image_path, self.save_dir)
+                        else:
+                            if attempt < max_retries - 1:
+                                continue
+                            error_msg = f"Failed to download image, status: {response.status}"
+                            self._add_failed_image(image_url, post_id, error_msg)
+                            return None
 
                 except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                     if attempt < max_retries - 1:
@@ -269,6 +487,13 @@ class ShuimuCrawler:
         
         return None
 
+    def _parse_list_sync(self, content: bytes) -> List[Tuple[str, str]]:
+        """在解析线程中解析列表页，返回(标题, 链接)列表"""
+        # 列表页固定为gbk编码
+        root = lxml.html.fromstring(content, parser=self._get_parser('gbk'))
+        # 一次XPath遍历取出所有帖子的标题链接
+        return [(a.text_content().strip(), a.get('href')) for a in LIST_XPATH(root)]
+
     async def parse_list_page(self, session: aiohttp.ClientSession, page_num: int) -> List[Dict]:
         """解析列表页"""
         url = f'{self.board_url}?p={page_num}'
@@ -276,42 +501,37 @@ class ShuimuCrawler:
         if not content:
             return []
 
+        try:
+            loop = asyncio.get_running_loop()
+            links = await loop.run_in_executor(self._exec, self._parse_list_sync, content)
+        except (etree.ParserError, ValueError) as e:
+            logger.error("Error parsing list page %s: %s", page_num, e)
+            return []
+
         posts = []
-        soup = BeautifulSoup(content, 'lxml')
-        
-        # 查找所有帖子行
-        table = soup.find('table', class_='board-list')
-        if table:
-            for tr in table.find_all('tr'):
-                try:
-                    # 查找标题单元格（第2个td）
-                    tds = tr.find_all('td')
-                    if len(tds) >= 3:
-                        title_td = tds[1]  # 第2个td是标题
-                        if title_td and title_td.a:
-                            title = title_td.a.text.strip()
-                            link = title_td.a['href']
-                            if title and link:
-                                # 构建完整的帖子URL
-                                full_link = urljoin(self.base_url, link)
-                                # 提取帖子ID
-                                post_id = link.split('/')[-1]
-                                # 检查是否已下载
-                                safe_title = self._get_safe_filename(title)
-                                if safe_title not in self.downloaded_files:
-                                    posts.append({
-                                        'title': title,
-                                        'url': full_link,
-                                        'post_id': post_id
-                                    })
-                                    logger.info(f"Found new post: {title}")
-                                else:
-                                    logger.debug(f"Skip downloaded post: {title}")
-                except Exception as e:
-                    logger.error(f"Error parsing post row: {str(e)}")
-                    continue
-        else:
+        if not links:
             logger.warning("Table with class 'board-list' not found!")
+            return posts
+
+        for title, link in links:
+            if title:
+                # 构建完整的帖子URL
+                full_link = self._absolute_url(link)
+                # 提取帖子ID
+                post_id = link.rpartition('/')[2]
+                # 检查是否已下载
+                safe_title = self._get_safe_filename(title)
+                if safe_title not in self.downloaded_files:
+                    posts.append({
+                        'title': title,
+                        'safe_title': safe_title,
+                        'url': full_link,
+                        'post_id': post_id
+                    })
+                    logger.info("Found new post: %s", title)
+                elif logger.isEnabledFor(logging.DEBUG):
+                    # 重复爬取时这里最频繁，未开启DEBUG时直接跳过
+                    logger.debug("Skip downloaded post: %s", title)
         
         return posts
 
@@ -322,134 +542,153 @@ class ShuimuCrawler:
             return None
 
         try:
-            soup = BeautifulSoup(content, 'lxml')
-            tables = soup.find_all('table')
-            
-            for table in tables:
-                rows = table.find_all('tr')
-                if len(rows) >= 2:
-                    cells = rows[1].find_all('td')
-                    if len(cells) >= 2:
-                        content_cell = cells[1]
-                        if content_cell:
-                            # 提取图片URL并保存位置信息
-                            images = []
-                            img_tags = content_cell.find_all('img')
-                            for i, img in enumerate(img_tags):
-                                img_url = img.get('src')
-                                if img_url:
-                                    # 确保图片URL是完整的
-                                    if not img_url.startswith(('http://', 'https://')):
-                                        img_url = urljoin(self.base_url, img_url)
-
-                                    images.append(img_url)
-                                    # 使用特殊标记替换图片标签
-                                    img.replace_with(f'__IMG_PLACEHOLDER_{i}__')
-                            
-                            if not images:
-                                logger.info(f"No valid images found in post {post_id}")
-                            
-                            # 获取文本内容，保持原始格式
-                            text_parts = []
-                            for element in content_cell.descendants:
-                                if isinstance(element, str) and element.strip():
-                                    text_parts.append(element.strip())
-                                elif element.name == 'br' or element.name == 'p':
-                                    text_parts.append('\n')
-                            
-                            # 合并文本，保持段落格式
-                            content_text = ' '.join(text_parts)
-                            # 规范化段落（删除多余空行，但保留段落间的空行）
-                            paragraphs = [p.strip() for p in content_text.split('\n')]
-                            cleaned_paragraphs = []
-                            for p in paragraphs:
-                                if p:  # 如果段落不为空
-                                    cleaned_paragraphs.append(p)
-                                elif cleaned_paragraphs and cleaned_paragraphs[-1] != '':
-                                    # 在非空段落之间添加空行
-                                    cleaned_paragraphs.append('')
-                            
-                            cleaned_content = '\n\n'.join(p for p in cleaned_paragraphs if p or cleaned_paragraphs[-1] != '')
-                            return cleaned_content, images
-            
-            logger.warning("No suitable content found in any table!")
-            return None
-            
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._exec, self._parse_detail_sync, content, post_id)
         except Exception as e:
-            logger.error(f"Error parsing article content: {str(e)}")
+            logger.error("Error parsing article content: %s", e)
             return None
 
-    async def save_to_file(self, title: str, content: str, image_paths: List[str]):
-        """保存内容到Markdown文件"""
+    def _parse_detail_sync(self, content: bytes, post_id: str) -> Optional[Tuple[str, List[str]]]:
+        """在解析线程中解析详情页，返回内容和图片URL列表"""
+        # 详情页按页面声明的编码解码，避免把UTF-8页面强制当作gbk
+        root = lxml.html.fromstring(content, parser=self._get_parser())
+        # 按文档顺序逐个检查表格，找到第一个正文单元格后立即停止
+        content_cell = None
+        for table in root.iter('table'):
+            cells = DETAIL_CELL_XPATH(table)
+            if cells:
+                content_cell = cells[0]
+                break
+        if content_cell is None:
+            logger.warning("No suitable content found in any table!")
+            return None
+
+        # 一次遍历正文单元格：收集图片URL并在原位置写入占位符，
+        # 同时按文档顺序收集文本，br之后和p的内容之前插入换行符
+        images = []
+        parts = []
+        for event, node in etree.iterwalk(content_cell, events=('start', 'end')):
+            tag = node.tag
+            if event == 'start':
+                if tag == 'img':
+                    img_url = node.get('src')
+                    if img_url:
+                        # 确保图片URL是完整的
+                        img_url = self._absolute_url(img_url)
+                        parts.append(f'__IMG_PLACEHOLDER_{len(images)}__')
+                        images.append(img_url)
+                    continue
+                if tag == 'p':
+                    parts.append('\n')
+                # 注释和处理指令的文本不属于正文
+                if node.text and isinstance(tag, str):
+                    parts.append(node.text)
+            elif node is not content_cell:
+                if tag == 'br':
+                    parts.append('\n')
+                if node.tail:
+                    parts.append(node.tail)
+        content_text = ''.join(parts)
+        
+        if not images:
+            logger.info("No valid images found in post %s", post_id)
+        
+        # 规范化段落：压缩行内空白，去掉每行首尾空白和多余空行，段落之间保留一个空行
+        cleaned_content = _CLEAN_NL_RE.sub('\n\n', _WS_RE.sub(' ', content_text)).strip()
+        return cleaned_content, images
+
+    def _check_image_paths(self, image_paths: List[Optional[str]]) -> List[Optional[str]]:
+        """检查图片文件是否存在，不存在的替换为None"""
+        valid_image_paths = []
+        for image_path in image_paths:
+            if image_path and not os.path.exists(os.path.join(self.save_dir, image_path)):
+                logger.warning("Image file not found: %s", image_path)
+                image_path = None
+            valid_image_paths.append(image_path)
+        return valid_image_paths
+
+    async def save_to_file(self, title: str, content: str, image_paths: List[Optional[str]]):
+        """保存内容到Markdown文件，image_paths按图片在帖子中的位置排列，下载失败的为None"""
         safe_title = self._get_safe_filename(title)
         filename = os.path.join(self.save_dir, f"{safe_title}.md")
         
+        loop = asyncio.get_running_loop()
+        
         try:
-            # 检查图片是否真的存在
-            valid_image_paths = []
-            for image_path in image_paths:
-                if image_path and os.path.exists(os.path.join(self.save_dir, image_path)):
-                    valid_image_paths.append(image_path)
-                else:
-                    logger.warning(f"Image file not found: {image_path}")
+            # 检查图片是否真的存在，保持与占位符序号一致的位置
+            valid_image_paths = await loop.run_in_executor(None, self._check_image_paths, image_paths)
             
             # 构建Markdown内容
             markdown_content = f"# {title}\n\n"
             
-            # 替换内容中的图片占位符为实际的Markdown图片
-            processed_content = content
-            for i, image_path in enumerate(valid_image_paths):
-                if image_path:
-                    # 替换占位符为markdown格式的图片
-                    placeholder = f'__IMG_PLACEHOLDER_{i}__'
-                    markdown_image = f'\n![图片{i+1}]({image_path})\n'
-                    processed_content = processed_content.replace(placeholder, markdown_image)
+            # 一次扫描替换所有图片占位符，缺失的图片直接去掉占位符
+            def replace_placeholder(match):
+                i = int(match.group(1))
+                image_path = valid_image_paths[i] if i < len(valid_image_paths) else None
+                return f'\n![图片{i+1}]({image_path})\n' if image_path else ''
             
             # 添加处理后的内容
-            markdown_content += processed_content
+            markdown_content += _PLACEHOLDER_RE.sub(replace_placeholder, content)
             
-            # 保存文件
-            async with asyncio.Lock():  # 使用锁来保护文件写入
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(markdown_content)
-                logger.info(f"Saved: {filename} with {len(valid_image_paths)} images")
-                # 添加到已下载集合
+            # 保存文件（每个帖子写入不同的文件，无需加锁）
+            # 先写临时文件再原子替换，写入中断时不会留下不完整的文件
+            tmp_filename = filename + '.tmp'
+            try:
+                async with aiofiles.open(tmp_filename, 'w', encoding='utf-8') as f:
+                    await f.write(markdown_content)
+                await aiofiles.os.replace(tmp_filename, filename)
+            except BaseException:
+                try:
+                    os.remove(tmp_filename)
+                except OSError:
+                    pass
+                raise
+            logger.info("Saved: %s with %s images", filename, sum(1 for p in valid_image_paths if p))
+            # 添加到已下载集合并记录到索引
+            if safe_title not in self.downloaded_files:
                 self.downloaded_files.add(safe_title)
+                await loop.run_in_executor(None, self._append_downloaded_index, safe_title)
             
-            # 验证文件是否正确保存
-            try:
-                with open(filename, 'r', encoding='utf-8') as f:
-                    test_content = f.read()
-                if not test_content:
-                    logger.warning(f"Warning: File {filename} appears to be empty")
-            except Exception as e:
-                logger.warning(f"Warning: Unable to verify file content: {str(e)}")
+            # 验证文件是否正确保存（只检查文件大小，不回读内容）
+            if await aiofiles.os.path.getsize(filename) == 0:
+                logger.warning("Warning: File %s appears to be empty", filename)
                 
         except Exception as e:
-            logger.error(f"Error saving {filename}: {str(e)}")
+            logger.error("Error saving %s: %s", filename, e)
 
     async def process_post(self, session: aiohttp.ClientSession, post: Dict):
         """处理单个帖子"""
         try:
-            safe_title = self._get_safe_filename(post['title'])
+            # 列表页已计算过安全文件名；旧的失败记录中可能没有该字段
+            safe_title = post.get('safe_title') or self._get_safe_filename(post['title'])
             if safe_title not in self.downloaded_files:
                 result = await self.parse_detail_page(session, post['url'], post['post_id'])
                 if result:
                     content, image_urls = result
                     if image_urls:
-                        logger.info(f"Found {len(image_urls)} images in post: {post['title']}")
-                        # 并发下载所有图片
+                        logger.info("Found %s images in post: %s", len(image_urls), post['title'])
+                        # 同一帖子中重复的图片URL只下载一次，否则并发下载会写同一个临时文件
+                        unique_urls = list(dict.fromkeys(image_urls))
+                        # 并发下载所有图片，单张图片出错不影响其他图片
                         download_tasks = [
                             self.download_image(session, image_url, post['post_id'])
-                            for image_url in image_urls
+                            for image_url in unique_urls
                         ]
-                        image_paths = await asyncio.gather(*download_tasks)
-                        # 过滤掉下载失败的图片（返回None的结果）
-                        image_paths = [path for path in image_paths if path]
-                        logger.info(f"Successfully downloaded {len(image_paths)}/{len(image_urls)} images for post: {post['title']}")
+                        results = await asyncio.gather(*download_tasks, return_exceptions=True)
+                        # 下载失败的图片（返回None或抛出异常）记为None
+                        url_paths = {}
+                        for image_url, result in zip(unique_urls, results):
+                            if isinstance(result, BaseException):
+                                logger.error("Error downloading image %s: %s", image_url, result)
+                                result = None
+                            url_paths[image_url] = result
+                        # 按原顺序映射回每个占位符
+                        image_paths = [url_paths[image_url] for image_url in image_urls]
+                        downloaded = sum(1 for path in image_paths if path)
+                        logger.info("Successfully downloaded %s/%s images for post: %s", downloaded, len(image_urls), post['title'])
                     else:
                         image_paths = []
-                        logger.info(f"No images found in post: {post['title']}")
+                        logger.info("No images found in post: %s", post['title'])
                     
                     await self.save_to_file(post['title'], content, image_paths)
                     self._remove_failed_post(post['url'])  # 处理成功，移除失败记录
@@ -458,62 +697,136 @@ class ShuimuCrawler:
         except Exception as e:
             self._add_failed_post(post, str(e))
 
-    async def crawl_page(self, session: aiohttp.ClientSession, page_num: int):
-        """爬取单个页面的所有帖子"""
-        try:
-            posts = await self.parse_list_page(session, page_num)
-            if posts:
-                # 并发处理所有帖子
-                tasks = [self.process_post(session, post) for post in posts]
-                await asyncio.gather(*tasks, return_exceptions=True)  # 添加return_exceptions=True以防止单个任务失败影响其他任务
-            else:
-                logger.info(f"No new posts found on page {page_num}")
-        except Exception as e:
-            logger.error(f"Error processing page {page_num}: {str(e)}")
-
     async def retry_failed_items(self, session: aiohttp.ClientSession):
         """重试失败的帖子和图片"""
         # 重试失败的帖子
         failed_posts = list(self.failed_posts.values())
         if failed_posts:
-            logger.info(f"Retrying {len(failed_posts)} failed posts...")
+            logger.info("Retrying %s failed posts...", len(failed_posts))
             tasks = [self.process_post(session, failed_post['post']) for failed_post in failed_posts]
             await asyncio.gather(*tasks)
 
         # 重试失败的图片
         failed_images = list(self.failed_images.values())
         if failed_images:
-            logger.info(f"Retrying {len(failed_images)} failed images...")
+            logger.info("Retrying %s failed images...", len(failed_images))
             tasks = [self.download_image(session, failed_image['url'], failed_image['post_id']) 
                     for failed_image in failed_images]
             await asyncio.gather(*tasks)
 
+    async def _produce_posts(self, session: aiohttp.ClientSession, start_page: int, end_page: int,
+                             queue: asyncio.Queue):
+        """并发解析列表页，每解析完一页就把新帖子放入队列"""
+        async def fetch_page(page_num: int):
+            try:
+                return page_num, await self.parse_list_page(session, page_num)
+            except Exception as e:
+                logger.error("Error processing page %s: %s", page_num, e)
+                return page_num, None
+
+        logger.info("Fetching list pages %s-%s", start_page, end_page)
+        # 翻页过程中可能出现重复帖子
+        seen_urls = set()
+        for next_page in asyncio.as_completed(
+            [fetch_page(page_num) for page_num in range(start_page, end_page + 1)]
+        ):
+            page_num, posts = await next_page
+            if posts is None:
+                continue
+            if not posts:
+                logger.info("No new posts found on page %s", page_num)
+                continue
+            for post in posts:
+                if post['url'] not in seen_urls:
+                    seen_urls.add(post['url'])
+                    await queue.put(post)
+        logger.info("Queued %s new posts", len(seen_urls))
+
+    async def _post_worker(self, session: aiohttp.ClientSession, queue: asyncio.Queue):
+        """从队列中逐个取出帖子处理，单个帖子出错不影响后续帖子"""
+        while True:
+            post = await queue.get()
+            try:
+                await self.process_post(session, post)
+            except Exception as e:
+                logger.error("Error processing post %s: %s", post.get('url'), e)
+            finally:
+                queue.task_done()
+
     async def crawl(self, start_page=1, end_page=1):
         """爬取指定页面范围的帖子"""
-        connector = aiohttp.TCPConnector(limit=None, force_close=True)  # 移除连接数限制
-        timeout = aiohttp.ClientTimeout(total=30, connect=10, sock_connect=10, sock_read=10)
+        # 由连接器在套接字层限制并发请求数，解析和写盘不再占用并发名额
+        # 同时缓存DNS解析结果，避免每个请求都重新解析域名
+        # 保持长连接复用，省去每个请求的TCP和TLS握手
+        # （aiohttp在每个新连接上默认开启TCP_NODELAY，无需额外设置）
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.max_concurrency,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+            enable_cleanup_closed=True
+        )
+        # 限制建连和读取的时间，避免卡住的连接长期占用连接池
+        timeout = aiohttp.ClientTimeout(total=30, sock_connect=5, sock_read=15)
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            # 初始化会话
-            await self._init_session(session)
-            
-            # 首先重试之前失败的项目
-            await self.retry_failed_items(session)
-            
-            # 并发爬取所有页面
-            tasks = []
-            for page_num in range(start_page, end_page + 1):
-                logger.info(f"Creating task for page {page_num}")
-                tasks.append(self.crawl_page(session, page_num))
-            
-            # 使用gather并发执行所有任务，允许单个任务失败
-            await asyncio.gather(*tasks, return_exceptions=True)
+        # 后台批量写入失败记录
+        stop_writer = asyncio.Event()
+        writer = asyncio.create_task(self._failed_items_writer(stop_writer))
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                # cookies由会话的cookie jar自动保存并随请求发送
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                headers=self.DEFAULT_HEADERS
+            ) as session:
+                # 初始化会话
+                await self._init_session(session)
+                
+                # 首先重试之前失败的项目
+                await self.retry_failed_items(session)
+                
+                # 列表页解析出的帖子放入有界队列，由固定数量的工作协程处理，
+                # 不再一次性为所有帖子创建协程，内存占用不随爬取规模增长
+                queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+                workers = [
+                    asyncio.create_task(self._post_worker(session, queue))
+                    for _ in range(self.max_concurrency)
+                ]
+                try:
+                    await self._produce_posts(session, start_page, end_page, queue)
+                    await queue.join()
+                finally:
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            stop_writer.set()
+            await writer
+            # 解析已全部完成，释放解析线程池
+            self._exec.shutdown(wait=False)
 
     def _get_safe_filename(self, title: str) -> str:
         """获取安全的文件名"""
-        return re.sub(r'[\\/*?:"<>|]', '_', title)
+        return _safe_filename(title)
+
+def run(coro):
+    """运行协程，可用时使用uvloop事件循环（Windows不支持uvloop）"""
+    if uvloop is None or sys.platform == 'win32':
+        return asyncio.run(coro)
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(coro)
+    uvloop.install()
+    return asyncio.run(coro)
 
 def main():
+    parser = argparse.ArgumentParser(description='爬取水木社区房产版面')
+    parser.add_argument('--quiet', action='store_true', help='只输出警告和错误日志')
+    args = parser.parse_args()
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    
     # 使用示例
     save_dir = './shuimu_data'  # 可以修改保存目录
     max_concurrency = 50  # 增加并发数以支持更多图片同时下载
@@ -524,7 +837,7 @@ def main():
     )
     
     # 运行异步爬虫
-    asyncio.run(crawler.crawl(start_page=1, end_page=2))  # 爬取1-2000页
+    run(crawler.crawl(start_page=1, end_page=2))  # 爬取1-2000页
 
 if __name__ == '__main__':
     main() 
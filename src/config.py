@@ -3,7 +3,7 @@ import os
 from pathlib import Path
 from dataclasses import dataclass, field, asdict
 from typing import List, Optional, Dict
-import json
+import orjson
 
 # 基础配置
 BASE_URL = 'https://www.newsmth.net'
@@ -115,8 +115,7 @@ class CrawlerConfig:
     @classmethod
     def from_json(cls, json_path: str) -> 'CrawlerConfig':
         """从 JSON 文件加载配置"""
-        with open(json_path, 'r', encoding='utf-8') as f:
-            config_dict = json.load(f)
+        config_dict = orjson.loads(Path(json_path).read_bytes())
             
         # 处理板块配置
         boards = [BoardConfig(**board_data) for board_data in config_dict.pop('boards', [])]
@@ -147,5 +146,4 @@ class CrawlerConfig:
                 for board in self.boards
             ]
         }
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(config_dict, f, indent=2)
\ No newline at end of file
+        Path(json_path).write_bytes(orjson.dumps(config_dict, option=orjson.OPT_INDENT_2))
\ No newline at end of file
@@ -1,22 +1,63 @@
 import asyncio
 import aiohttp
+import codecs
 import random
-import json
+import itertools
 from pathlib import Path
-from typing import Optional, List, Dict, Set
-from bs4 import BeautifulSoup
+from typing import Optional, List, Dict, Set, Tuple, Union
+import lxml.html
+from lxml import etree
 import logging
+import logging.handlers
+import queue
+import threading
 from datetime import datetime
 import re
 import os
-from src.config import CrawlerConfig, BoardConfig
+import shutil
+from src.config import CrawlerConfig, BoardConfig, CHUNK_SIZE
 from src.utils import get_safe_filename, save_json_file
 from src.state import StateManager, PostState
 import aiofiles
 from urllib.parse import urljoin, urlparse
 
+# 编码检测库为可选依赖，优先使用更快的cchardet
+try:
+    import cchardet as chardet
+except ImportError:
+    try:
+        import chardet
+    except ImportError:
+        chardet = None
+
 logger = logging.getLogger(__name__)
 
+def _class_xpath(name: str) -> str:
+    """按类名匹配的XPath谓词，与CSS的.name选择器等价"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# 预编译的列表页XPath：先取出所有非置顶的帖子行，再在行内取各个字段
+LIST_ROW_XPATH = etree.XPath(
+    f"//table[{_class_xpath('board-list')}]//tr[.//td[{_class_xpath('title')}]][not({_class_xpath('top')})]"
+)
+LIST_TITLE_XPATH = etree.XPath(f"(.//td[{_class_xpath('title')}]//a)[1]")
+LIST_AUTHOR_XPATH = etree.XPath(f"(.//td[{_class_xpath('author')}])[1]")
+LIST_TIME_XPATH = etree.XPath(f"(.//td[{_class_xpath('time')}])[1]")
+
+# 预编译的详情页XPath：标题、正文、作者和发布时间
+DETAIL_TITLE_XPATH = etree.XPath(f"(//h3[{_class_xpath('post-title')}])[1]")
+DETAIL_CONTENT_XPATH = etree.XPath(f"(//div[{_class_xpath('post-content')}])[1]")
+DETAIL_AUTHOR_XPATH = etree.XPath(f"(//div[{_class_xpath('post-meta')}]//span[{_class_xpath('author')}])[1]")
+DETAIL_TIME_XPATH = etree.XPath(f"(//div[{_class_xpath('post-meta')}]//span[{_class_xpath('time')}])[1]")
+
+# 页面开头<meta>或<?xml?>中声明的编码
+META_CHARSET_RE = re.compile(rb'<(?:meta[^>]+charset|\?xml[^>]+encoding)=["\']?([\w-]+)', re.I)
+
+# 文件名中的非法字符，以及从URL中提取帖子ID和版面名称的正则
+SAFE_FILENAME_RE = re.compile(r'[<>:"/\\|?*]')
+POST_ID_RE = re.compile(r'/article/\w+/(\w+)')
+BOARD_NAME_RE = re.compile(r'/board/(\w+)/?')
+
 class Crawler:
     """异步网络爬虫"""
     
@@ -31,9 +72,34 @@ class Crawler:
         self.semaphore: Optional[asyncio.Semaphore] = None
         self.crawled_urls: Set[str] = set()
         self.board_posts: Dict[str, int] = {board.name: 0 for board in config.boards}
+        # 已创建的目录，避免每个帖子都重复调用mkdir
+        self._created_dirs: Set[Path] = set()
+        # 已下载的图片：URL -> 文件路径；正在下载的图片：URL -> 下载结果的 Future
+        self._image_downloads: Dict[str, Union[Path, asyncio.Future]] = {}
+        # 每个解析线程各自缓存HTML解析器，lxml解析器不能在线程间共享
+        self._parser_local = threading.local()
+        
+        # 预先为每个User-Agent构建完整的请求头，每次请求只需随机挑选一个
+        self._header_templates = [
+            {
+                'User-Agent': user_agent,
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+                'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
+            }
+            for user_agent in config.user_agents
+        ]
+        # 打乱一次后轮流使用各个请求头和代理，不必每次请求都随机挑选
+        self._header_cycle = itertools.cycle(
+            random.sample(self._header_templates, len(self._header_templates))
+        )
+        proxies = list(config.proxies.values()) if config.proxies else []
+        self._proxy_cycle = itertools.cycle(random.sample(proxies, len(proxies))) if proxies else None
         
-        # 创建状态管理器
-        self.state_manager = StateManager(config.output_dir / '.state')
+        # 创建状态管理器，所有版面同时爬取，内存中要能放下全部版面的状态
+        self.state_manager = StateManager(
+            config.output_dir / '.state',
+            max_loaded_boards=max(StateManager.MAX_LOADED_BOARDS, len(config.boards))
+        )
         
         # 创建输出目录
         self.config.output_dir.mkdir(parents=True, exist_ok=True)
@@ -42,10 +108,6 @@ class Crawler:
             
         # 设置日志
         self._setup_logging()
-        
-        # 加载所有版面的状态
-        for board in config.boards:
-            self.state_manager.load_board_state(board.name)
     
     def _setup_logging(self):
         """配置日志"""
@@ -53,6 +115,9 @@ class Crawler:
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
         
+        self._log_handler: Optional[logging.Handler] = None
+        self._log_listener: Optional[logging.handlers.QueueListener] = None
+        
         # 如果logger已经有处理器，就不再添加
         if not self.logger.handlers:
             # 创建文件处理器，明确指定UTF-8编码
@@ -68,13 +133,32 @@ class Crawler:
             file_handler.setFormatter(formatter)
             console_handler.setFormatter(formatter)
             
+            # 记录日志时只放入队列，由后台线程格式化并写入文件和控制台，
+            # 避免并发任务在事件循环上等待日志的文件I/O
+            log_queue = queue.Queue(-1)
+            self._log_listener = logging.handlers.QueueListener(
+                log_queue, file_handler, console_handler, respect_handler_level=True
+            )
+            self._log_listener.start()
+            
             # 添加处理器到logger
-            self.logger.addHandler(file_handler)
-            self.logger.addHandler(console_handler)
+            self._log_handler = logging.handlers.QueueHandler(log_queue)
+            self.logger.addHandler(self._log_handler)
     
     async def __aenter__(self):
         """异步上下文管理器入口"""
-        self.session = aiohttp.ClientSession()
+        # 按并发数设置连接池大小并缓存DNS，保持长连接复用TCP和TLS会话
+        connector = aiohttp.TCPConnector(
+            limit=self.config.max_concurrent_tasks,
+            limit_per_host=self.config.max_concurrent_tasks,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+            enable_cleanup_closed=True
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.config.timeout)
+        )
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -95,25 +179,53 @@ class Crawler:
     
     async def close(self):
         """关闭爬虫，释放资源"""
+        # 提交尚未保存的帖子状态并关闭状态数据库
+        await self.state_manager.close_async()
         if self.session:
             await self.session.close()
+        # 写完队列中剩余的日志后停止日志线程
+        if self._log_listener:
+            self.logger.removeHandler(self._log_handler)
+            self._log_listener.stop()
+            self._log_listener = None
     
     def _get_headers(self) -> Dict[str, str]:
-        """获取随机User-Agent的请求头"""
-        return {
-            'User-Agent': random.choice(self.config.user_agents),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
-        }
+        """获取轮换User-Agent的请求头，返回的字典各请求共享，调用方不能修改"""
+        return next(self._header_cycle)
+    
+    @staticmethod
+    def _detect_encoding(content: bytes) -> str:
+        """检测页面编码
+        
+        Args:
+            content: 页面原始字节
+            
+        Returns:
+            编码名称，无法检测时返回utf-8
+        """
+        # 优先使用页面<meta>中声明的编码
+        match = META_CHARSET_RE.search(content, 0, 2048)
+        if match:
+            return match.group(1).decode('ascii')
+        
+        # 只取开头一段样本检测，避免对整个页面做统计
+        if chardet is not None:
+            detected = chardet.detect(content[:4096])
+            if detected and detected.get('encoding'):
+                return detected['encoding']
+        return 'utf-8'
     
-    async def _fetch_page(self, url: str) -> Optional[str]:
+    async def _fetch_page(self, url: str) -> Optional[Tuple[bytes, str]]:
         """获取页面内容
         
+        页面不在这里解码，由lxml解析器按编码直接解析字节，
+        带<?xml encoding?>声明的页面不能以str交给lxml解析
+        
         Args:
             url: 要获取的页面URL
             
         Returns:
-            页面HTML内容，失败返回None
+            (页面原始字节, 页面编码)，失败返回None
         """
         for attempt in range(self.config.max_retries):
             try:
@@ -121,34 +233,19 @@ class Crawler:
                     async with self.session.get(
                         url,
                         headers=self._get_headers(),
-                        proxy=random.choice(self.config.proxies) if self.config.proxies else None,
-                        timeout=self.config.timeout
+                        proxy=next(self._proxy_cycle) if self._proxy_cycle else None
                     ) as response:
                         if response.status == 200:
-                            # 获取原始字节数据
                             content = await response.read()
-                            
-                            # 尝试不同的编码
-                            encodings = ['utf-8', 'gbk', 'gb2312', 'gb18030', 'big5']
-                            for encoding in encodings:
+                            # 优先使用响应头声明的编码，没有声明或无法识别时从页面内容检测
+                            encoding = response.charset
+                            if encoding:
                                 try:
-                                    return content.decode(encoding)
-                                except UnicodeDecodeError:
-                                    continue
-                            
-                            # 如果所有编码都失败，使用chardet检测
-                            try:
-                                import chardet
-                                detected = chardet.detect(content)
-                                if detected and detected['encoding']:
-                                    return content.decode(detected['encoding'])
-                            except ImportError:
-                                self.logger.warning("chardet未安装，无法自动检测编码")
-                            except Exception as e:
-                                self.logger.error(f"编码检测失败: {e}")
-                            
-                            # 最后尝试使用errors='ignore'
-                            return content.decode('utf-8', errors='ignore')
+                                    codecs.lookup(encoding)
+                                except LookupError:
+                                    self.logger.warning(f"未知的页面编码: {encoding}, 重新检测编码")
+                                    encoding = None
+                            return content, encoding or self._detect_encoding(content)
                         else:
                             self.logger.warning(f"获取页面失败: {url}, 状态码: {response.status}")
                             
@@ -169,6 +266,47 @@ class Crawler:
             board: 版面配置
         """
         self.logger.info(f"开始爬取版面: {board.name}")
+        
+        # 列表页由生产者逐页解析，帖子放入有界队列由固定数量的工作协程处理，
+        # 处理当前页帖子的同时就可以继续解析下一页
+        queue: asyncio.Queue = asyncio.Queue(maxsize=200)
+        workers = [
+            asyncio.create_task(self._post_worker(queue))
+            for _ in range(self.config.max_concurrent_tasks)
+        ]
+        try:
+            await self._produce_board_posts(board, queue)
+        finally:
+            # 每个工作协程收到一个None后退出
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    async def _post_worker(self, queue: asyncio.Queue):
+        """从队列中取出帖子处理，取到None时退出，单个帖子出错不影响后续帖子
+        
+        Args:
+            queue: 帖子队列，元素为(版面名称, 帖子ID, 帖子信息)
+        """
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            try:
+                await self._process_post(*item)
+            except Exception as e:
+                self.logger.error(f"处理帖子出错: {item[2].get('url')}, 错误: {e}", exc_info=True)
+    
+    async def _produce_board_posts(self, board: BoardConfig, queue: asyncio.Queue):
+        """逐页解析版面列表，把需要爬取的帖子放入队列
+        
+        列表按时间倒序排列，新帖子会把旧帖子挤到后面的页，所以每次都从第一页开始，
+        已完成的帖子由帖子状态跳过，遇到没有新帖子的页面时停止
+        
+        Args:
+            board: 版面配置
+            queue: 帖子队列
+        """
         page = 1
         
         while True:
@@ -185,13 +323,13 @@ class Crawler:
             url = f"{board.url}?p={page}"
             self.logger.info(f"爬取页面: {url}")
             
-            html = await self._fetch_page(url)
-            if not html:
+            fetched = await self._fetch_page(url)
+            if not fetched:
                 self.logger.error(f"获取页面失败: {url}")
                 break
                 
-            soup = BeautifulSoup(html, 'html.parser')
-            posts = self._parse_list_page(soup)
+            # 解析在线程池中进行，避免阻塞事件循环上的网络请求
+            posts = await asyncio.get_running_loop().run_in_executor(None, self._parse_list_page, *fetched)
             
             if not posts:
                 self.logger.info(f"版面 {board.name} 页面 {page} 没有找到帖子，可能是最后一页")
@@ -199,83 +337,100 @@ class Crawler:
                 
             self.logger.info(f"找到 {len(posts)} 个帖子")
             
-            # 处理每个帖子
-            tasks = []
-            for post in posts:
+            # 一次筛选出本页需要处理的帖子
+            post_ids = [self._extract_post_id(post['url']) for post in posts]
+            pending = set(self.state_manager.should_process_posts(
+                board.name, [post_id for post_id in post_ids if post_id], self.config.max_retries))
+            
+            # 把需要处理的帖子放入队列
+            queued = 0
+            for post, post_id in zip(posts, post_ids):
                 # 检查是否达到最大帖子数限制
                 if board.max_posts and self.board_posts[board.name] >= board.max_posts:
                     break
                     
-                # 获取帖子ID
-                post_id = self._extract_post_id(post['url'])
                 if not post_id:
                     self.logger.warning(f"无法提取帖子ID: {post['url']}")
                     continue
                     
                 # 检查帖子状态
-                state = self.state_manager.get_post_state(board.name, post_id)
-                if state == PostState.COMPLETED:
+                if post_id not in pending:
                     self.logger.debug(f"帖子已爬取: {post['url']}")
                     continue
                     
-                # 创建处理帖子的任务
-                task = asyncio.create_task(self._process_post(board.name, post_id, post))
-                tasks.append(task)
+                # 交给工作协程处理，队列满时在这里等待
+                await queue.put((board.name, post_id, post))
+                queued += 1
                 
                 # 更新已爬取的帖子数
                 self.board_posts[board.name] += 1
             
-            if tasks:
-                # 等待所有任务完成
-                await asyncio.gather(*tasks)
-            
             # 如果没有找到新的帖子，说明已经爬取完成
-            if not tasks:
+            if not queued:
                 self.logger.info(f"版面 {board.name} 页面 {page} 没有新帖子需要爬取")
                 break
                 
             page += 1
+    
+    def _get_parser(self, encoding: str) -> lxml.html.HTMLParser:
+        """获取当前线程指定编码的HTML解析器，libxml2不支持该编码时改用utf-8
+        
+        Args:
+            encoding: 页面编码
             
-            # 在页面之间添加延迟
-            await asyncio.sleep(self.config.retry_delay)
+        Returns:
+            HTML解析器
+        """
+        parsers = getattr(self._parser_local, 'parsers', None)
+        if parsers is None:
+            parsers = self._parser_local.parsers = {}
+        parser = parsers.get(encoding)
+        if parser is None:
+            try:
+                parser = lxml.html.HTMLParser(encoding=encoding)
+            except LookupError:
+                self.logger.warning(f"未知的页面编码: {encoding}, 使用utf-8解析")
+                parser = lxml.html.HTMLParser(encoding='utf-8')
+            parsers[encoding] = parser
+        return parser
     
-    def _parse_list_page(self, soup: BeautifulSoup) -> List[Dict]:
+    def _parse_list_page(self, content: bytes, encoding: str) -> List[Dict]:
         """解析列表页
         
         Args:
-            soup: BeautifulSoup对象
+            content: 列表页原始字节
+            encoding: 页面编码
             
         Returns:
             帖子信息列表
         """
         posts = []
         try:
-            # 获取所有帖子行
-            rows = soup.select('table.board-list tr')
+            root = lxml.html.fromstring(content, parser=self._get_parser(encoding))
             
-            for row in rows:
-                # 跳过表头和置顶帖
-                if not row.select_one('td.title') or 'top' in row.get('class', []):
-                    continue
-                    
+            # 一次XPath取出所有非置顶的帖子行（表头没有td.title，不会被选中）
+            for row in LIST_ROW_XPATH(root):
                 try:
                     # 获取标题和链接
-                    title_elem = row.select_one('td.title a')
-                    if not title_elem:
+                    title_elems = LIST_TITLE_XPATH(row)
+                    if not title_elems:
                         continue
+                    title_elem = title_elems[0]
                         
-                    title = title_elem.get_text(strip=True)
-                    url = title_elem['href']
+                    title = title_elem.text_content().strip()
+                    url = title_elem.get('href')
+                    if not url:
+                        continue
                     if url.startswith('/'):
                         url = urljoin(self.config.base_url, url)
                     
                     # 获取作者
-                    author_elem = row.select_one('td.author')
-                    author = author_elem.get_text(strip=True) if author_elem else '匿名'
+                    author_elems = LIST_AUTHOR_XPATH(row)
+                    author = author_elems[0].text_content().strip() if author_elems else '匿名'
                     
                     # 获取发布时间
-                    time_elem = row.select_one('td.time')
-                    post_time = time_elem.get_text(strip=True) if time_elem else ''
+                    time_elems = LIST_TIME_XPATH(row)
+                    post_time = time_elems[0].text_content().strip() if time_elems else ''
                     
                     posts.append({
                         'title': title,
@@ -293,55 +448,66 @@ class Crawler:
             
         return posts
     
-    def _parse_detail_page(self, soup: BeautifulSoup) -> Dict:
+    def _parse_detail_page(self, content: bytes, encoding: str) -> Dict:
         """解析详情页
         
         Args:
-            soup: BeautifulSoup对象
+            content: 详情页原始字节
+            encoding: 页面编码
             
         Returns:
             帖子详情信息
         """
         try:
+            root = lxml.html.fromstring(content, parser=self._get_parser(encoding))
+            
             # 获取帖子标题
-            title_elem = soup.select_one('h3.post-title')
-            title = title_elem.get_text(strip=True) if title_elem else '无标题'
+            title_elems = DETAIL_TITLE_XPATH(root)
+            title = title_elems[0].text_content().strip() if title_elems else '无标题'
             self.logger.info(f"找到帖子标题: {title}")
             
             # 获取帖子内容
-            content_elem = soup.select_one('div.post-content')
-            if not content_elem:
+            content_elems = DETAIL_CONTENT_XPATH(root)
+            if not content_elems:
                 self.logger.error("未找到帖子内容元素")
                 return {}
+            content_elem = content_elems[0]
                 
-            # 获取所有图片链接
+            # 一次遍历正文：同时收集图片链接和文本（每段文本去掉首尾空白后拼接）
             images = []
-            img_elems = content_elem.select('img')
-            for img in img_elems:
-                src = img.get('src', '')
-                if src:
-                    if src.startswith('//'):
-                        src = 'https:' + src
-                    elif src.startswith('/'):
-                        src = self.config.base_url + src
-                    images.append(src)
+            texts = []
+            for event, node in etree.iterwalk(content_elem, events=('start', 'end')):
+                if event == 'start':
+                    if node.tag == 'img':
+                        src = node.get('src', '')
+                        if src:
+                            if src.startswith('//'):
+                                src = 'https:' + src
+                            elif src.startswith('/'):
+                                src = self.config.base_url + src
+                            images.append(src)
+                    # 注释和处理指令的文本不属于正文
+                    elif node.text and isinstance(node.tag, str):
+                        texts.append(node.text.strip())
+                elif node is not content_elem and node.tail:
+                    texts.append(node.tail.strip())
                     
             self.logger.info(f"找到 {len(images)} 张图片")
             
             # 获取纯文本内容
-            content = content_elem.get_text(strip=True)
+            text = ''.join(texts)
             
             # 获取作者信息
-            author_elem = soup.select_one('div.post-meta span.author')
-            author = author_elem.get_text(strip=True) if author_elem else '匿名'
+            author_elems = DETAIL_AUTHOR_XPATH(root)
+            author = author_elems[0].text_content().strip() if author_elems else '匿名'
             
             # 获取发布时间
-            time_elem = soup.select_one('div.post-meta span.time')
-            post_time = time_elem.get_text(strip=True) if time_elem else ''
+            time_elems = DETAIL_TIME_XPATH(root)
+            post_time = time_elems[0].text_content().strip() if time_elems else ''
             
             return {
                 'title': title,
-                'content': content,
+                'content': text,
                 'author': author,
                 'date': post_time,
                 'images': images
@@ -362,7 +528,7 @@ class Crawler:
         try:
             # 创建版面目录
             board_dir = self.config.output_dir / board_name / 'posts'
-            board_dir.mkdir(parents=True, exist_ok=True)
+            self._ensure_dir(board_dir)
             
             # 生成安全的文件名
             filename = self._get_safe_filename(content.get('title', post.get('title', 'untitled')))
@@ -377,60 +543,133 @@ class Crawler:
             }
             
             json_path = board_dir / f"{filename}.json"
-            await save_json_file(json_path, post_data)
-            
-            # 准备Markdown内容
-            md_content = [
-                f"# {post_data['title']}",
-                "",
-                f"作者: {post_data['author']}",
-                f"发布时间: {post_data['date']}",
-                f"原文链接: {post['url']}",
-                "",
-                "---",
-                "",
-                content.get('content', ''),
-                "",
-            ]
+            await save_json_file(post_data, json_path)
+            
+            # 准备Markdown内容，固定部分用一个模板生成
+            md_header = (
+                f"# {post_data['title']}\n\n"
+                f"作者: {post_data['author']}\n"
+                f"发布时间: {post_data['date']}\n"
+                f"原文链接: {post['url']}\n\n"
+                f"---\n\n"
+                f"{content.get('content', '')}\n"
+            )
+            # 下载成功的图片：(序号, 相对路径)
+            saved_images: List[Tuple[int, str]] = []
             
             # 如果有图片，创建图片目录并下载
             if content.get('images') and self.config.save_images:
                 image_dir = self.config.image_dir / filename
-                image_dir.mkdir(parents=True, exist_ok=True)
+                self._ensure_dir(image_dir)
                 
-                for i, img_url in enumerate(content['images'], 1):
-                    try:
-                        # 下载图片
-                        async with self.session.get(img_url, headers=self._get_headers()) as response:
-                            if response.status == 200:
-                                # 获取文件扩展名
-                                ext = os.path.splitext(urlparse(img_url).path)[1] or '.jpg'
-                                if not ext.startswith('.'):
-                                    ext = '.' + ext
-                                    
-                                # 保存图片
-                                image_path = image_dir / f"image_{i}{ext}"
-                                async with aiofiles.open(image_path, 'wb') as f:
-                                    await f.write(await response.read())
-                                    
-                                # 添加图片链接到Markdown
-                                relative_path = os.path.relpath(image_path, board_dir)
-                                md_content.append(f"![图片{i}]({relative_path})")
-                                md_content.append("")
-                                
-                    except Exception as e:
-                        self.logger.error(f"下载图片失败 {img_url}: {e}")
+                # 并发下载帖子中的所有图片，结果与图片顺序一一对应
+                image_paths = await asyncio.gather(*[
+                    self._download_image(img_url, image_dir, i)
+                    for i, img_url in enumerate(content['images'], 1)
+                ])
+                saved_images = [
+                    (i, os.path.relpath(image_path, board_dir))
+                    for i, image_path in enumerate(image_paths, 1)
+                    if image_path
+                ]
             
             # 保存Markdown文件
             md_path = board_dir / f"{filename}.md"
-            async with aiofiles.open(md_path, 'w', encoding='utf-8') as f:
-                await f.write('\n'.join(md_content))
+            img_section = ''.join(f"\n![图片{i}]({path})\n" for i, path in saved_images)
+            md_bytes = (md_header + img_section).encode('utf-8')
+            await asyncio.to_thread(md_path.write_bytes, md_bytes)
                 
             self.logger.info(f"保存帖子成功: {md_path}")
             
         except Exception as e:
             self.logger.error(f"保存帖子失败: {e}", exc_info=True)
     
+    async def _download_image(self, img_url: str, image_dir: Path, index: int) -> Optional[Path]:
+        """下载帖子中的一张图片
+        
+        Args:
+            img_url: 图片URL
+            image_dir: 图片保存目录
+            index: 图片在帖子中的序号（从1开始）
+            
+        Returns:
+            图片保存路径，下载失败返回None
+        """
+        # 获取文件扩展名
+        ext = os.path.splitext(urlparse(img_url).path)[1] or '.jpg'
+        if not ext.startswith('.'):
+            ext = '.' + ext
+        image_path = image_dir / f"image_{index}{ext}"
+        
+        try:
+            # 同一图片（头像、表情等）只下载一次，其他帖子直接链接已下载的文件；
+            # 正在下载时等待下载结果，避免并发的帖子重复请求
+            pending = self._image_downloads.get(img_url)
+            if pending is not None:
+                source = await pending if isinstance(pending, asyncio.Future) else pending
+                if source is None:
+                    return None
+                await asyncio.to_thread(self._link_or_copy, source, image_path)
+                return image_path
+            
+            future = asyncio.get_running_loop().create_future()
+            self._image_downloads[img_url] = future
+            saved = False
+            # 先写入临时文件，下载完整后再替换，中断时不会留下不完整的图片
+            part_path = image_path.with_name(image_path.name + '.part')
+            try:
+                # 下载图片，与页面请求共用并发限制
+                async with self.semaphore:
+                    async with self.session.get(img_url, headers=self._get_headers()) as response:
+                        if response.status == 200:
+                            # 保存图片，边接收边写入，不把整张图片读入内存
+                            async with aiofiles.open(part_path, 'wb') as f:
+                                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                                    await f.write(chunk)
+                            await asyncio.to_thread(os.replace, part_path, image_path)
+                            saved = True
+            finally:
+                # 下载失败时移除记录和临时文件，之后的帖子可以重新下载
+                # 下载成功后只保留文件路径，不再持有 Future
+                if saved:
+                    self._image_downloads[img_url] = image_path
+                else:
+                    del self._image_downloads[img_url]
+                future.set_result(image_path if saved else None)
+                if not saved:
+                    await asyncio.to_thread(part_path.unlink, missing_ok=True)
+            return image_path if saved else None
+            
+        except Exception as e:
+            self.logger.error(f"下载图片失败 {img_url}: {e}")
+            return None
+    
+    @staticmethod
+    def _link_or_copy(source: Path, target: Path):
+        """为已下载的图片创建硬链接，文件系统不支持硬链接时复制文件
+
+        先写入临时文件再替换目标，已存在的旧图片也会被更新
+        """
+        if source == target:
+            return
+        tmp_path = target.with_name(target.name + '.part')
+        try:
+            tmp_path.unlink(missing_ok=True)
+            try:
+                os.link(source, tmp_path)
+            except OSError:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, target)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    
+    def _ensure_dir(self, path: Path):
+        """确保目录存在，每个目录只创建一次"""
+        if path not in self._created_dirs:
+            path.mkdir(parents=True, exist_ok=True)
+            self._created_dirs.add(path)
+    
     @staticmethod
     def _get_safe_filename(filename: str) -> str:
         """生成安全的文件名
@@ -442,7 +681,7 @@ class Crawler:
             安全的文件名
         """
         # 移除非法字符
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+        filename = SAFE_FILENAME_RE.sub('_', filename)
         # 限制长度
         return filename[:100]
     
@@ -454,36 +693,39 @@ class Crawler:
             post_id: 帖子ID
             post_info: 帖子基本信息
         """
+        url, title = post_info['url'], post_info['title']
         try:
             # 更新帖子状态为处理中
-            self.state_manager.set_post_state(board_name, post_id, PostState.PROCESSING)
+            self.state_manager.set_post_state(board_name, post_id, PostState.DOWNLOADING, url, title)
             
             # 获取帖子详情页
-            html = await self._fetch_page(post_info['url'])
-            if not html:
-                self.logger.error(f"获取帖子详情页失败: {post_info['url']}")
-                self.state_manager.set_post_state(board_name, post_id, PostState.FAILED)
+            fetched = await self._fetch_page(url)
+            if not fetched:
+                self.logger.error(f"获取帖子详情页失败: {url}")
+                self.state_manager.set_post_state(
+                    board_name, post_id, PostState.FAILED, url, title, error="获取帖子详情页失败")
                 return
                 
-            # 解析详情页
-            soup = BeautifulSoup(html, 'html.parser')
-            content = self._parse_detail_page(soup)
+            # 解析详情页（在线程池中进行，避免阻塞事件循环）
+            content = await asyncio.get_running_loop().run_in_executor(None, self._parse_detail_page, *fetched)
             
             if not content:
-                self.logger.error(f"解析帖子详情页失败: {post_info['url']}")
-                self.state_manager.set_post_state(board_name, post_id, PostState.FAILED)
+                self.logger.error(f"解析帖子详情页失败: {url}")
+                self.state_manager.set_post_state(
+                    board_name, post_id, PostState.FAILED, url, title, error="解析帖子详情页失败")
                 return
                 
             # 保存帖子
             await self._save_post(board_name, post_info, content)
             
             # 更新帖子状态为完成
-            self.state_manager.set_post_state(board_name, post_id, PostState.COMPLETED)
-            self.logger.info(f"帖子处理完成: {post_info['url']}")
+            self.state_manager.set_post_state(board_name, post_id, PostState.COMPLETED, url, title)
+            self.logger.info(f"帖子处理完成: {url}")
             
         except Exception as e:
-            self.logger.error(f"处理帖子失败: {post_info['url']}, 错误: {e}", exc_info=True)
-            self.state_manager.set_post_state(board_name, post_id, PostState.FAILED)
+            self.logger.error(f"处理帖子失败: {url}, 错误: {e}", exc_info=True)
+            self.state_manager.set_post_state(
+                board_name, post_id, PostState.FAILED, url, title, error=str(e) or type(e).__name__)
     
     def _extract_post_id(self, url: str) -> str:
         """从URL中提取帖子ID
@@ -496,7 +738,7 @@ class Crawler:
         """
         try:
             # 尝试从URL中提取帖子ID
-            match = re.search(r'/article/(\w+)/?', url)
+            match = POST_ID_RE.search(url)
             if match:
                 return match.group(1)
         except Exception as e:
@@ -514,7 +756,7 @@ class Crawler:
         """
         try:
             # 尝试从URL中提取版面名称
-            match = re.search(r'/board/(\w+)/?', url)
+            match = BOARD_NAME_RE.search(url)
             if match:
                 return match.group(1)
         except Exception as e:
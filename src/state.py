@@ -1,10 +1,17 @@
-import json
+import asyncio
+import atexit
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Set, Optional, List, Any
-from dataclasses import dataclass, field, asdict
+from typing import Dict, Set, Optional, List
+from dataclasses import dataclass, field
 import logging
 from enum import Enum
-from datetime import datetime
+import orjson
+
+from .utils import now_iso
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +23,15 @@ class PostState(Enum):
     FAILED = "failed"        # 下载失败
     RETRY = "retry"         # 需要重试
 
-@dataclass
+# 不再处理的状态
+_TERMINAL = frozenset({PostState.COMPLETED})
+# 重试次数未用完时才处理的状态
+_RETRYABLE = frozenset({PostState.FAILED, PostState.RETRY})
+
+# Python 3.10起dataclass支持slots，实例不再带__dict__，帖子多时能省下不少内存
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(**_DATACLASS_SLOTS)
 class PostInfo:
     """帖子信息"""
     url: str
@@ -25,107 +40,174 @@ class PostInfo:
     retry_count: int = 0
     last_attempt: Optional[str] = None
     error_message: Optional[str] = None
-    downloaded_images: List[str] = field(default_factory=list)
-    failed_images: List[str] = field(default_factory=list)
+    downloaded_images: Set[str] = field(default_factory=set)
+    failed_images: Set[str] = field(default_factory=set)
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class BoardState:
     """版面状态"""
     name: str
     last_page: int = 1
     posts: Dict[str, PostInfo] = field(default_factory=dict)
 
-@dataclass
-class PostState:
-    """帖子状态"""
-    url: str
-    title: str
-    downloaded: bool = False
-    images_downloaded: bool = False
-    last_attempt: str = field(default_factory=lambda: datetime.now().isoformat())
-    retry_count: int = 0
-    
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            'url': self.url,
-            'title': self.title,
-            'downloaded': self.downloaded,
-            'images_downloaded': self.images_downloaded,
-            'last_attempt': self.last_attempt,
-            'retry_count': self.retry_count
-        }
-    
-    @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'PostState':
-        return cls(**data)
-
 class StateManager:
-    """状态管理器"""
+    """状态管理器
+    
+    状态保存在 state.db（WAL模式的sqlite），每次变更只写一行，
+    累计一定次数后统一提交；旧版本的 {版面}.json 状态文件在首次加载时导入
+    """
+    
+    # 累计这么多次状态变更后提交一次
+    FLUSH_EVERY = 50
+    # 距上次提交超过这么多秒时，下一次变更即提交
+    FLUSH_INTERVAL = 5.0
+    # 内存中默认最多保留的版面数，超出时换出最久未访问的版面
+    MAX_LOADED_BOARDS = 8
+    
+    _SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS boards (
+            name TEXT PRIMARY KEY,
+            last_page INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS posts (
+            board TEXT NOT NULL,
+            id TEXT NOT NULL,
+            url TEXT NOT NULL,
+            title TEXT NOT NULL,
+            state TEXT NOT NULL,
+            retry INTEGER NOT NULL DEFAULT 0,
+            last_attempt TEXT,
+            error TEXT,
+            PRIMARY KEY (board, id)
+        );
+        -- ok=1 时url为已下载图片的保存路径，ok=0 时为下载失败的图片URL
+        CREATE TABLE IF NOT EXISTS post_images (
+            board TEXT NOT NULL,
+            id TEXT NOT NULL,
+            url TEXT NOT NULL,
+            ok INTEGER NOT NULL,
+            PRIMARY KEY (board, id, url, ok)
+        );
+    '''
     
-    def __init__(self, state_dir: Path):
+    def __init__(self, state_dir: Path, max_loaded_boards: int = MAX_LOADED_BOARDS):
         """初始化状态管理器
         
         Args:
             state_dir: 状态文件保存目录
+            max_loaded_boards: 内存中最多保留的版面数，应不少于同时爬取的版面数，
+                否则正在爬取的版面会被反复换出再整个重新加载
         """
+        self.max_loaded_boards = max_loaded_boards
         self.state_dir = state_dir
         self.state_dir.mkdir(parents=True, exist_ok=True)
-        self.boards: Dict[str, BoardState] = {}
+        # 按访问顺序排列，最近访问的在末尾
+        self.boards: OrderedDict[str, BoardState] = OrderedDict()
+        # 自动提交模式，由_execute显式开启事务以批量提交；
+        # flush_async/close_async会在其他线程中使用连接
+        self._db: Optional[sqlite3.Connection] = sqlite3.connect(
+            self.state_dir / 'state.db', isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(self._SCHEMA)
+        self._pending_mutations = 0
+        self._last_flush = time.monotonic()
+        # 进程退出时提交尚未保存的变更
+        atexit.register(self.close)
     
     def _get_board_file(self, board_name: str) -> Path:
-        """获取版面状态文件路径"""
+        """获取旧版本的版面状态文件路径"""
         return self.state_dir / f"{board_name}.json"
     
     def load_board_state(self, board_name: str) -> BoardState:
-        """加载版面状态"""
+        """从数据库加载版面状态，数据库中没有该版面时导入旧版本的状态文件"""
+        row = self._db.execute(
+            'SELECT last_page FROM boards WHERE name = ?',
+            (board_name,)).fetchone()
+        if row is None:
+            board_state = self._load_legacy_board_state(board_name)
+            self.save_board_state(board_state)
+            return board_state
+        
+        board_state = BoardState(name=board_name, last_page=row[0])
+        for post_id, url, title, state, retry, last_attempt, error in self._db.execute(
+                'SELECT id, url, title, state, retry, last_attempt, error FROM posts WHERE board = ?',
+                (board_name,)):
+            board_state.posts[post_id] = PostInfo(
+                url=url,
+                title=title,
+                state=PostState(state),
+                retry_count=retry,
+                last_attempt=last_attempt,
+                error_message=error
+            )
+        for post_id, url, ok in self._db.execute(
+                'SELECT id, url, ok FROM post_images WHERE board = ?', (board_name,)):
+            post = board_state.posts.get(post_id)
+            if post is not None:
+                (post.downloaded_images if ok else post.failed_images).add(url)
+        return board_state
+    
+    def _load_legacy_board_state(self, board_name: str) -> BoardState:
+        """读取旧版本的 {版面}.json 状态文件"""
+        board_state = BoardState(name=board_name)
         state_file = self._get_board_file(board_name)
         if state_file.exists():
-            with state_file.open('r', encoding='utf-8') as f:
-                data = json.load(f)
-                board_state = BoardState(name=board_name)
-                board_state.last_page = data.get('last_page', 1)
-                
-                for post_id, post_data in data.get('posts', {}).items():
-                    board_state.posts[post_id] = PostInfo(
-                        url=post_data['url'],
-                        title=post_data['title'],
-                        state=PostState(post_data['state']),
-                        retry_count=post_data['retry_count'],
-                        last_attempt=post_data.get('last_attempt'),
-                        error_message=post_data.get('error_message'),
-                        downloaded_images=post_data.get('downloaded_images', []),
-                        failed_images=post_data.get('failed_images', [])
-                    )
-                return board_state
-        return BoardState(name=board_name)
+            data = orjson.loads(state_file.read_bytes())
+            board_state.last_page = data.get('last_page', 1)
+            
+            for post_id, post_data in data.get('posts', {}).items():
+                board_state.posts[post_id] = PostInfo(
+                    url=post_data['url'],
+                    title=post_data['title'],
+                    state=PostState(post_data['state']),
+                    retry_count=post_data['retry_count'],
+                    last_attempt=post_data.get('last_attempt'),
+                    error_message=post_data.get('error_message'),
+                    downloaded_images=set(post_data.get('downloaded_images', [])),
+                    failed_images=set(post_data.get('failed_images', []))
+                )
+        return board_state
     
     def save_board_state(self, board_state: BoardState):
-        """保存版面状态"""
-        state_file = self._get_board_file(board_state.name)
-        data = {
-            'last_page': board_state.last_page,
-            'posts': {
-                post_id: {
-                    'url': post.url,
-                    'title': post.title,
-                    'state': post.state.value,
-                    'retry_count': post.retry_count,
-                    'last_attempt': post.last_attempt,
-                    'error_message': post.error_message,
-                    'downloaded_images': post.downloaded_images,
-                    'failed_images': post.failed_images
-                }
-                for post_id, post in board_state.posts.items()
-            }
-        }
-        with state_file.open('w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        """把整个版面状态写入数据库"""
+        name = board_state.name
+        self._execute(
+            'INSERT OR REPLACE INTO boards (name, last_page) VALUES (?, ?)',
+            (name, board_state.last_page))
+        self._executemany(
+            'INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [self._post_row(name, post_id, post) for post_id, post in board_state.posts.items()])
+        self._executemany(
+            'INSERT OR IGNORE INTO post_images VALUES (?, ?, ?, ?)',
+            [(name, post_id, url, ok)
+             for post_id, post in board_state.posts.items()
+             for ok, urls in ((1, post.downloaded_images), (0, post.failed_images))
+             for url in urls])
+    
+    @staticmethod
+    def _post_row(board_name: str, post_id: str, post: PostInfo) -> tuple:
+        """生成posts表的一行"""
+        return (board_name, post_id, post.url, post.title, post.state.value,
+                post.retry_count, post.last_attempt, post.error_message)
+    
+    def _save_post(self, board_name: str, post_id: str, post: PostInfo):
+        """把一个帖子的状态写入数据库"""
+        self._execute('INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      self._post_row(board_name, post_id, post))
     
     def get_board_state(self, board_name: str) -> BoardState:
         """获取版面状态，如果不存在则加载"""
-        if board_name not in self.boards:
-            self.boards[board_name] = self.load_board_state(board_name)
-        return self.boards[board_name]
+        board_state = self.boards.get(board_name)
+        if board_state is not None:
+            self.boards.move_to_end(board_name)
+            return board_state
+        
+        board_state = self.boards[board_name] = self.load_board_state(board_name)
+        while len(self.boards) > self.max_loaded_boards:
+            # 状态都已写入数据库，直接移出内存
+            self.boards.popitem(last=False)
+        return board_state
     
     def update_post_state(self, board_name: str, post_id: str, 
                          state: PostState, error: str = None):
@@ -134,107 +216,164 @@ class StateManager:
         if post_id in board_state.posts:
             post = board_state.posts[post_id]
             post.state = state
-            post.last_attempt = datetime.now().isoformat()
+            post.last_attempt = now_iso()
             if error:
                 post.error_message = error
                 post.retry_count += 1
-            self.save_board_state(board_state)
+            self._save_post(board_name, post_id, post)
+    
+    def get_post_state(self, board_name: str, post_id: str) -> Optional[PostState]:
+        """获取帖子状态，帖子不存在时返回None"""
+        post = self.get_board_state(board_name).posts.get(post_id)
+        return post.state if post else None
+    
+    def set_post_state(self, board_name: str, post_id: str, state: PostState,
+                       url: str, title: str, error: Optional[str] = None):
+        """设置帖子状态，帖子不存在时先添加
+        
+        变更累计一定次数后批量提交，结束时需要调用close
+        
+        Args:
+            board_name: 版面名称
+            post_id: 帖子ID
+            state: 新状态
+            url: 帖子URL
+            title: 帖子标题
+            error: 失败原因，给出时记录下来并增加重试次数
+        """
+        board_state = self.get_board_state(board_name)
+        post = board_state.posts.get(post_id)
+        if post is None:
+            post = board_state.posts[post_id] = PostInfo(url=url, title=title)
+        else:
+            post.url, post.title = url, title
+        post.state = state
+        post.last_attempt = now_iso()
+        if error:
+            post.error_message = error
+            post.retry_count += 1
+        self._save_post(board_name, post_id, post)
+    
+    def _begin(self):
+        """没有进行中的事务时开启一个，变更在flush时统一提交"""
+        if not self._db.in_transaction:
+            self._db.execute('BEGIN')
+    
+    def _execute(self, sql: str, params: tuple):
+        """在当前事务中执行一条变更，达到阈值时提交"""
+        self._begin()
+        self._db.execute(sql, params)
+        self._count_mutation()
+    
+    def _executemany(self, sql: str, rows: List[tuple]):
+        """在当前事务中批量执行变更，达到阈值时提交"""
+        if rows:
+            self._begin()
+            self._db.executemany(sql, rows)
+            self._count_mutation()
+    
+    def _count_mutation(self):
+        """记录一次变更，达到阈值时提交"""
+        self._pending_mutations += 1
+        if (self._pending_mutations >= self.FLUSH_EVERY
+                or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL):
+            self.flush()
+    
+    def flush(self):
+        """提交尚未保存的变更"""
+        if self._db is not None and self._db.in_transaction:
+            self._db.execute('COMMIT')
+        self._pending_mutations = 0
+        self._last_flush = time.monotonic()
+    
+    async def flush_async(self):
+        """在线程中提交尚未保存的变更，用于爬虫退出时不阻塞事件循环
+        
+        调用时不应再有其他任务修改状态
+        """
+        if self._db is not None and self._db.in_transaction:
+            await asyncio.to_thread(self.flush)
+    
+    def close(self):
+        """提交尚未保存的变更并关闭数据库，可重复调用"""
+        if self._db is None:
+            return
+        self.flush()
+        self._db.close()
+        self._db = None
+    
+    async def close_async(self):
+        """在线程中执行close，调用时不应再有其他任务修改状态"""
+        await asyncio.to_thread(self.close)
     
     def add_post(self, board_name: str, post_id: str, url: str, title: str):
         """添加新帖子"""
         board_state = self.get_board_state(board_name)
         if post_id not in board_state.posts:
-            board_state.posts[post_id] = PostInfo(url=url, title=title)
-            self.save_board_state(board_state)
+            post = board_state.posts[post_id] = PostInfo(url=url, title=title)
+            self._save_post(board_name, post_id, post)
     
     def should_process_post(self, board_name: str, post_id: str, 
                           max_retries: int) -> bool:
         """判断是否应该处理帖子"""
-        board_state = self.get_board_state(board_name)
-        if post_id not in board_state.posts:
-            return True
-            
-        post = board_state.posts[post_id]
-        if post.state in [PostState.COMPLETED]:
-            return False
-            
-        if post.state in [PostState.FAILED, PostState.RETRY]:
-            return post.retry_count < max_retries
-            
-        return True
+        return bool(self.should_process_posts(board_name, [post_id], max_retries))
+    
+    def should_process_posts(self, board_name: str, post_ids: List[str],
+                             max_retries: int) -> List[str]:
+        """从一批帖子中筛选出应该处理的帖子，保持原有顺序"""
+        posts = self.get_board_state(board_name).posts
+        return [
+            post_id for post_id in post_ids
+            if (post := posts.get(post_id)) is None
+            or (post.state not in _TERMINAL
+                and (post.state not in _RETRYABLE or post.retry_count < max_retries))
+        ]
     
     def add_downloaded_image(self, board_name: str, post_id: str, 
                            image_path: str):
         """记录已下载的图片"""
         board_state = self.get_board_state(board_name)
         if post_id in board_state.posts:
-            post = board_state.posts[post_id]
-            if image_path not in post.downloaded_images:
-                post.downloaded_images.append(image_path)
-                self.save_board_state(board_state)
+            images = board_state.posts[post_id].downloaded_images
+            before = len(images)
+            images.add(image_path)
+            if len(images) != before:
+                self._execute('INSERT OR IGNORE INTO post_images VALUES (?, ?, ?, 1)',
+                              (board_name, post_id, image_path))
     
     def add_failed_image(self, board_name: str, post_id: str, 
                         image_url: str):
         """记录下载失败的图片"""
         board_state = self.get_board_state(board_name)
         if post_id in board_state.posts:
-            post = board_state.posts[post_id]
-            if image_url not in post.failed_images:
-                post.failed_images.append(image_url)
-                self.save_board_state(board_state)
+            images = board_state.posts[post_id].failed_images
+            before = len(images)
+            images.add(image_url)
+            if len(images) != before:
+                self._execute('INSERT OR IGNORE INTO post_images VALUES (?, ?, ?, 0)',
+                              (board_name, post_id, image_url))
     
     def get_failed_images(self, board_name: str, post_id: str) -> List[str]:
         """获取下载失败的图片列表"""
         board_state = self.get_board_state(board_name)
         if post_id in board_state.posts:
-            return board_state.posts[post_id].failed_images
+            return sorted(board_state.posts[post_id].failed_images)
         return []
     
     def get_downloaded_images(self, board_name: str, post_id: str) -> List[str]:
         """获取已下载的图片列表"""
         board_state = self.get_board_state(board_name)
         if post_id in board_state.posts:
-            return board_state.posts[post_id].downloaded_images
+            return sorted(board_state.posts[post_id].downloaded_images)
         return []
 
     def load_state(self) -> None:
         """加载所有版面的状态"""
-        for state_file in self.state_dir.glob('*.json'):
-            board_name = state_file.stem
-            self.boards[board_name] = self.load_board_state(board_name)
+        names = {row[0] for row in self._db.execute('SELECT name FROM boards')}
+        names.update(state_file.stem for state_file in self.state_dir.glob('*.json'))
+        for board_name in names:
+            self.get_board_state(board_name)
 
     def save_state(self) -> None:
         """保存所有版面的状态"""
-        for board_state in self.boards.values():
-            self.save_board_state(board_state)
-
-    def add_post(self, url: str, title: str) -> None:
-        """添加新帖子"""
-        post_state = PostState(url=url, title=title)
-        self.posts[url] = post_state
-
-    def mark_post_downloaded(self, url: str) -> None:
-        """标记帖子已下载"""
-        if url in self.posts:
-            self.posts[url].downloaded = True
-
-    def mark_images_downloaded(self, url: str) -> None:
-        """标记帖子图片已下载"""
-        if url in self.posts:
-            self.posts[url].images_downloaded = True
-
-    def increment_retry_count(self, url: str) -> None:
-        """增加重试次数"""
-        if url in self.posts:
-            self.posts[url].retry_count += 1
-
-    def get_unfinished_posts(self) -> Set[str]:
-        """获取未完成的帖子URL列表"""
-        return {url for url, state in self.posts.items() 
-                if not state.downloaded or not state.images_downloaded}
-
-    def should_retry(self, url: str, max_retries: int) -> bool:
-        """判断是否应该重试"""
-        if url not in self.posts:
-            return True
-        return self.posts[url].retry_count < max_retries
\ No newline at end of file
+        self.flush()
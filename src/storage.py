@@ -1,14 +1,27 @@
 import os
-import json
+import re
 import asyncio
-from typing import List, Dict, Set
+import atexit
+import time
+from collections import defaultdict
+from typing import List, Dict, Set, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
+import orjson
 
 from .config import BASE_DIR, IMAGES_DIR, STATE_DIR, logger
-from .utils import get_safe_filename
+from .utils import get_safe_filename, atomic_write_bytes, now_iso
+
+# 正文中的图片占位符，序号从0开始
+_PLACEHOLDER_RE = re.compile(r'__IMG_PLACEHOLDER_(\d+)__')
+# 各类失败记录的保存文件
+_FAILED_FILES = {'posts': 'failed_posts.json', 'images': 'failed_images.json'}
 
 class StorageManager:
+    # 失败记录累计这么多条变更或距上次写盘超过这么多秒时写盘
+    FAILED_FLUSH_EVERY = 32
+    FAILED_FLUSH_INTERVAL = 1.0
+    
     def __init__(self):
         self.base_dir = BASE_DIR
         self.images_dir = IMAGES_DIR
@@ -16,6 +29,17 @@ class StorageManager:
         self.downloaded_files = self._load_downloaded_files()
         self.failed_posts = self._load_failed_items('failed_posts.json')
         self.failed_images = self._load_failed_items('failed_images.json')
+        # 同一文件的写入互斥，不同文件可以并发写入；没有协程使用时移除锁，避免字典无限增长
+        self._file_locks: Dict[Path, asyncio.Lock] = {}
+        self._file_lock_users: Dict[Path, int] = defaultdict(int)
+        # 失败记录只在内存中修改，批量写盘
+        self._failed_dirty = {'posts': False, 'images': False}
+        self._failed_pending = 0
+        self._failed_last_flush = time.monotonic()
+        self._failed_flush_task: Optional[asyncio.Task] = None
+        self._failed_flush_timer: Optional[asyncio.TimerHandle] = None
+        # 进程退出时写入尚未保存的失败记录
+        atexit.register(self.flush_failed)
         
         logger.info(f"Found {len(self.downloaded_files)} downloaded files")
         logger.info(f"Found {len(self.failed_posts)} failed posts")
@@ -23,43 +47,111 @@ class StorageManager:
 
     def _load_downloaded_files(self) -> Set[str]:
         """加载已下载的文件列表"""
-        downloaded = set()
-        if self.base_dir.exists():
-            for filename in self.base_dir.glob('*.md'):
-                title = filename.stem
-                downloaded.add(title)
-        return downloaded
+        if not self.base_dir.exists():
+            return set()
+        # scandir直接返回目录项，不需要为每个文件创建Path对象
+        with os.scandir(self.base_dir) as entries:
+            return {entry.name[:-3] for entry in entries if entry.name.endswith('.md')}
 
     def _load_failed_items(self, filename: str) -> Dict:
         """加载失败的项目记录"""
         filepath = self.state_dir / filename
         if filepath.exists():
             try:
-                return json.loads(filepath.read_text(encoding='utf-8'))
+                return orjson.loads(filepath.read_bytes())
             except Exception as e:
                 logger.error(f"Error loading {filename}: {str(e)}")
                 return {}
         return {}
 
+    def _write_failed_items(self, items: Dict, filename: str):
+        """写入失败的项目记录，出错时抛出异常"""
+        atomic_write_bytes(self.state_dir / filename, orjson.dumps(items, option=orjson.OPT_INDENT_2))
+
     def _save_failed_items(self, items: Dict, filename: str):
         """保存失败的项目记录"""
-        filepath = self.state_dir / filename
         try:
-            filepath.write_text(
-                json.dumps(items, ensure_ascii=False, indent=2),
-                encoding='utf-8'
-            )
+            self._write_failed_items(items, filename)
         except Exception as e:
             logger.error(f"Error saving {filename}: {str(e)}")
 
+    def _mark_failed_dirty(self, kind: str):
+        """标记失败记录有变更，达到阈值时写盘，否则在间隔后写盘"""
+        self._failed_dirty[kind] = True
+        self._failed_pending += 1
+        if (self._failed_pending >= self.FAILED_FLUSH_EVERY
+                or time.monotonic() - self._failed_last_flush >= self.FAILED_FLUSH_INTERVAL):
+            self._schedule_failed_flush()
+        else:
+            self._schedule_trailing_flush()
+
+    def _schedule_trailing_flush(self):
+        """安排一次延迟写盘，变更较少时也会在间隔内写入；没有事件循环时留给退出时写入"""
+        if self._failed_flush_timer is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._failed_flush_timer = loop.call_later(self.FAILED_FLUSH_INTERVAL, self._schedule_failed_flush)
+
+    def _schedule_failed_flush(self):
+        """在事件循环中启动后台写盘任务，没有运行中的事件循环时直接写盘"""
+        if self._failed_flush_timer is not None:
+            self._failed_flush_timer.cancel()
+            self._failed_flush_timer = None
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_failed()
+            return
+        # 正在写盘的任务会一直写到没有变更为止，不需要重复启动
+        if self._failed_flush_task is None or self._failed_flush_task.done():
+            self._failed_flush_task = loop.create_task(self.flush_failed_async())
+
+    def _take_failed_snapshots(self) -> List[Tuple[str, Dict]]:
+        """取出有变更的失败记录的浅拷贝并清除变更标记"""
+        snapshots = [
+            (kind, dict(self.failed_posts if kind == 'posts' else self.failed_images))
+            for kind, dirty in self._failed_dirty.items() if dirty
+        ]
+        self._failed_dirty = {'posts': False, 'images': False}
+        self._failed_pending = 0
+        self._failed_last_flush = time.monotonic()
+        return snapshots
+
+    def flush_failed(self):
+        """把有变更的失败记录写入磁盘，用于进程退出等没有事件循环的场合"""
+        for kind, items in self._take_failed_snapshots():
+            self._save_failed_items(items, _FAILED_FILES[kind])
+
+    async def flush_failed_async(self):
+        """在线程中序列化并写入有变更的失败记录，直到没有新的变更，不阻塞事件循环"""
+        while any(self._failed_dirty.values()):
+            snapshots = self._take_failed_snapshots()
+            try:
+                for kind, items in snapshots:
+                    await asyncio.to_thread(self._write_failed_items, items, _FAILED_FILES[kind])
+            except Exception as e:
+                # 写入失败的记录重新标记为有变更，间隔后再试
+                logger.error(f"Error saving failed items: {str(e)}")
+                for kind, _ in snapshots:
+                    self._failed_dirty[kind] = True
+                self._schedule_trailing_flush()
+                return
+            except BaseException:
+                for kind, _ in snapshots:
+                    self._failed_dirty[kind] = True
+                raise
+
     def add_failed_post(self, post: Dict, error: str):
         """添加失败的帖子记录"""
         self.failed_posts[post['url']] = {
             'post': post,
             'error': error,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         }
-        self._save_failed_items(self.failed_posts, 'failed_posts.json')
+        self._mark_failed_dirty('posts')
 
     def add_failed_image(self, image_url: str, post_id: str, error: str):
         """添加失败的图片记录"""
@@ -67,21 +159,21 @@ class StorageManager:
             'url': image_url,
             'post_id': post_id,
             'error': error,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': now_iso()
         }
-        self._save_failed_items(self.failed_images, 'failed_images.json')
+        self._mark_failed_dirty('images')
 
     def remove_failed_post(self, url: str):
         """移除已成功的帖子记录"""
         if url in self.failed_posts:
             del self.failed_posts[url]
-            self._save_failed_items(self.failed_posts, 'failed_posts.json')
+            self._mark_failed_dirty('posts')
 
     def remove_failed_image(self, url: str):
         """移除已成功的图片记录"""
         if url in self.failed_images:
             del self.failed_images[url]
-            self._save_failed_items(self.failed_images, 'failed_images.json')
+            self._mark_failed_dirty('images')
 
     def get_image_path(self, post_id: str, image_url: str) -> Path:
         """获取图片保存路径"""
@@ -97,48 +189,79 @@ class StorageManager:
     async def save_image(self, image_data: bytes, image_path: Path) -> bool:
         """保存图片文件"""
         try:
-            image_path.write_bytes(image_data)
+            # 在线程中写入，多张图片的写入可以并发进行
+            await asyncio.to_thread(image_path.write_bytes, image_data)
             logger.info(f"Downloaded image: {image_path.name}")
             return True
         except Exception as e:
             logger.error(f"Error saving image {image_path}: {str(e)}")
             return False
 
+    def _existing_image_paths(self, image_paths: List[str]) -> List[Optional[str]]:
+        """检查图片是否实际存在，不存在的图片记为None，与占位符的位置一一对应
+        
+        同一目录下的图片只列一次目录，不逐个stat
+        """
+        entries_by_dir: Dict[str, Set[str]] = {}
+        valid_image_paths: List[Optional[str]] = []
+        for image_path in image_paths:
+            if image_path:
+                parent, name = os.path.split(image_path)
+                existing = entries_by_dir.get(parent)
+                if existing is None:
+                    try:
+                        with os.scandir(self.base_dir / parent) as entries:
+                            existing = {entry.name for entry in entries}
+                    except OSError:
+                        existing = set()
+                    entries_by_dir[parent] = existing
+                if name in existing:
+                    valid_image_paths.append(image_path)
+                    continue
+            logger.warning(f"Image file not found: {image_path}")
+            valid_image_paths.append(None)
+        return valid_image_paths
+
     async def save_to_file(self, title: str, content: str, image_paths: List[str]):
         """保存内容到Markdown文件"""
         safe_title = get_safe_filename(title)
         filename = self.base_dir / f"{safe_title}.md"
         
         try:
-            # 检查图片是否真的存在
-            valid_image_paths = []
-            for image_path in image_paths:
-                if image_path and (self.base_dir / image_path).exists():
-                    valid_image_paths.append(image_path)
-                else:
-                    logger.warning(f"Image file not found: {image_path}")
+            # 检查图片是否真的存在，在线程中执行，不阻塞事件循环
+            valid_image_paths = await asyncio.to_thread(self._existing_image_paths, image_paths)
             
             # 构建Markdown内容
             markdown_content = f"# {title}\n\n"
             
-            # 替换图片占位符
-            processed_content = content
-            for i, image_path in enumerate(valid_image_paths):
-                if image_path:
-                    placeholder = f'__IMG_PLACEHOLDER_{i}__'
-                    markdown_image = f'\n![图片{i+1}]({image_path})\n'
-                    processed_content = processed_content.replace(placeholder, markdown_image)
+            # 一次扫描替换所有图片占位符，没有对应图片的占位符直接去掉
+            def replace_placeholder(match: re.Match) -> str:
+                i = int(match.group(1))
+                if i < len(valid_image_paths) and valid_image_paths[i]:
+                    return f'\n![图片{i+1}]({valid_image_paths[i]})\n'
+                return ''
+            
+            processed_content = _PLACEHOLDER_RE.sub(replace_placeholder, content)
             
             markdown_content += processed_content
             
-            # 保存文件
-            async with asyncio.Lock():
-                filename.write_text(markdown_content, encoding='utf-8')
-                logger.info(f"Saved: {filename} with {len(valid_image_paths)} images")
-                self.downloaded_files.add(safe_title)
+            # 保存文件，在线程中原子写入，不阻塞事件循环，中断时不会留下不完整的文件
+            lock = self._file_locks.setdefault(filename, asyncio.Lock())
+            self._file_lock_users[filename] += 1
+            try:
+                async with lock:
+                    await asyncio.to_thread(atomic_write_bytes, filename, markdown_content.encode('utf-8'))
+                    saved_images = sum(1 for image_path in valid_image_paths if image_path)
+                    logger.info(f"Saved: {filename} with {saved_images} images")
+                    self.downloaded_files.add(safe_title)
+            finally:
+                self._file_lock_users[filename] -= 1
+                if not self._file_lock_users[filename]:
+                    del self._file_lock_users[filename]
+                    del self._file_locks[filename]
             
             # 验证文件
-            if not filename.exists() or filename.stat().st_size == 0:
+            if await asyncio.to_thread(os.path.getsize, filename) == 0:
                 logger.warning(f"Warning: File {filename} appears to be empty or not saved properly")
                 
         except Exception as e:
@@ -1,8 +1,17 @@
-import re
-import json
+import asyncio
+import functools
+import os
+import time
+from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict
 
+import orjson
+
+# 把文件名中不允许出现的字符替换为下划线
+_UNSAFE_TRANS = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+
+@functools.lru_cache(maxsize=8192)
 def get_safe_filename(filename: str) -> str:
     """
     将字符串转换为安全的文件名
@@ -14,7 +23,7 @@ def get_safe_filename(filename: str) -> str:
         安全的文件名
     """
     # 移除或替换不安全的字符
-    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    filename = filename.translate(_UNSAFE_TRANS)
     # 移除前后的空格和点
     filename = filename.strip('. ')
     # 如果文件名为空，使用默认名称
@@ -22,7 +31,37 @@ def get_safe_filename(filename: str) -> str:
         filename = 'untitled'
     return filename
 
-def save_json_file(data: Dict[str, Any], filepath: Path) -> None:
+# 最近一次生成的时间字符串及其生成时间
+# 缓存时长用单调时钟计算，系统时间被调整时缓存也不会卡住
+_now_iso_cache = ('', float('-inf'))
+
+def now_iso() -> str:
+    """
+    获取当前时间的ISO格式字符串，一秒内重复调用返回同一结果
+    
+    Returns:
+        ISO格式的时间字符串
+    """
+    global _now_iso_cache
+    t = time.monotonic()
+    if t - _now_iso_cache[1] >= 1.0:
+        _now_iso_cache = (datetime.now().isoformat(), t)
+    return _now_iso_cache[0]
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """
+    原子地写入文件：先写临时文件再替换，中断时不会留下不完整的文件
+    
+    Args:
+        path: 文件路径
+        data: 要写入的数据
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+async def save_json_file(data: Dict[str, Any], filepath: Path) -> None:
     """
     保存数据到JSON文件
     
@@ -30,5 +69,6 @@ def save_json_file(data: Dict[str, Any], filepath: Path) -> None:
         data: 要保存的数据
         filepath: 文件路径
     """
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
\ No newline at end of file
+    # 一次性序列化为UTF-8字节，在线程中一次写入
+    data_bytes = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    await asyncio.to_thread(atomic_write_bytes, filepath, data_bytes)
\ No newline at end of file
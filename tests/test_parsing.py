@@ -0,0 +1,114 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from crawler import ShuimuCrawler
+from src.config import CrawlerConfig
+from src.crawler import Crawler
+
+
+class RootDetailParseTest(unittest.TestCase):
+    """根目录爬虫的详情页解析：正文文本、图片占位符和图片列表"""
+
+    PAGE = '''<html><head><meta charset="utf-8"></head><body>
+<table><tr><td>nav</td></tr></table>
+<table class="article"><tr><td>头</td></tr><tr><td>作者</td><td>第一段   文字<br/>第二行<img src="/att/1.jpg"/>
+<p>新段落 <img src="//img.example.com/2.png"> 结尾</p><!-- 注释 --><img src="data:image/gif;base64,R0lG"></td></tr></table>
+</body></html>'''.encode('utf-8')
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.crawler = ShuimuCrawler(save_dir=self._tmp.name)
+
+    def tearDown(self):
+        self.crawler._exec.shutdown()
+        self._tmp.cleanup()
+
+    def test_text_placeholders_and_images(self):
+        content, images = self.crawler._parse_detail_sync(self.PAGE, '1')
+        self.assertEqual(
+            content,
+            '第一段 文字\n\n第二行__IMG_PLACEHOLDER_0__\n\n'
+            '新段落 __IMG_PLACEHOLDER_1__ 结尾__IMG_PLACEHOLDER_2__'
+        )
+        self.assertEqual(images, [
+            'https://www.newsmth.net/att/1.jpg',
+            'https://img.example.com/2.png',
+            'data:image/gif;base64,R0lG',
+        ])
+
+    def test_page_without_content_cell(self):
+        self.assertIsNone(self.crawler._parse_detail_sync(b'<html><body><p>x</p></body></html>', '1'))
+
+
+class _SrcCrawlerTestCase(unittest.TestCase):
+    """为 src 爬虫准备临时输出目录"""
+
+    PAGE = '''<html><head><meta charset="gbk"></head><body>
+<h3 class="post-title big"> 标题 </h3>
+<div class="post-meta"><span class="author"> 作者甲 </span><span class="time">2024-01-02</span></div>
+<div class="post-content">正文 <br/>第二行<!-- 注释 --><img src="/att/1.jpg"/>尾巴<img src="//h/2.png"><img></div>
+</body></html>'''.encode('gbk')
+
+    save_images = False
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self._tmp.name)
+        self.config = CrawlerConfig(
+            base_url='https://www.newsmth.net',
+            output_dir=self.tmp_dir / 'out',
+            image_dir=self.tmp_dir / 'out' / 'images',
+            boards=[],
+            save_images=self.save_images,
+        )
+        self.crawler = Crawler(self.config)
+
+    def tearDown(self):
+        asyncio.run(self.crawler.close())
+        self._tmp.cleanup()
+
+
+class SrcDetailParseTest(_SrcCrawlerTestCase):
+    """src 爬虫的详情页解析"""
+
+    def test_detail_fields(self):
+        self.assertEqual(self.crawler._parse_detail_page(self.PAGE, 'gbk'), {
+            'title': '标题',
+            'content': '正文第二行尾巴',
+            'author': '作者甲',
+            'date': '2024-01-02',
+            'images': ['https://www.newsmth.net/att/1.jpg', 'https://h/2.png'],
+        })
+
+    def test_page_without_content(self):
+        self.assertEqual(self.crawler._parse_detail_page('<h3 class="post-title">t</h3>'.encode(), 'utf-8'), {})
+
+
+class MarkdownRenderTest(_SrcCrawlerTestCase):
+    """src 爬虫保存的 Markdown 内容"""
+
+    save_images = True
+    POST = {'url': 'https://www.newsmth.net/nForum/article/B/1', 'title': 't'}
+
+    def _render(self) -> str:
+        content = self.crawler._parse_detail_page(self.PAGE, 'gbk')
+        asyncio.run(self.crawler._save_post('B', self.POST, content))
+        return (self.config.output_dir / 'B' / 'posts' / '标题.md').read_text(encoding='utf-8')
+
+    def test_markdown_with_downloaded_images(self):
+        # 第二张图片下载失败，只引用下载成功的图片
+        async def download_image(img_url, image_dir, index):
+            return image_dir / f'image_{index}.jpg' if index == 1 else None
+        self.crawler._download_image = download_image
+
+        self.assertEqual(self._render(), (
+            '# 标题\n\n'
+            '作者: 作者甲\n'
+            '发布时间: 2024-01-02\n'
+            '原文链接: https://www.newsmth.net/nForum/article/B/1\n\n'
+            '---\n\n'
+            '正文第二行尾巴\n'
+            '\n![图片1](../../images/标题/image_1.jpg)\n'
+        ))
@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.crawler import POST_ID_RE
+from src.state import StateManager, PostState
+
+
+class PostIdTest(unittest.TestCase):
+    """帖子ID提取"""
+
+    def test_article_url_yields_post_id(self):
+        url = 'https://www.newsmth.net/nForum/article/OurEstate/1234567'
+        self.assertEqual(POST_ID_RE.search(url).group(1), '1234567')
+
+    def test_posts_on_same_board_get_distinct_ids(self):
+        urls = ['/nForum/article/OurEstate/1', '/nForum/article/OurEstate/2']
+        self.assertEqual([POST_ID_RE.search(url).group(1) for url in urls], ['1', '2'])
+
+
+class RetryCapTest(unittest.TestCase):
+    """失败帖子的重试次数限制"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.state_dir = Path(self._tmp.name)
+        self.manager = StateManager(self.state_dir)
+
+    def tearDown(self):
+        self.manager.close()
+        self._tmp.cleanup()
+
+    def test_failed_post_is_retried_until_cap(self):
+        self.manager.set_post_state('B', '1', PostState.FAILED, 'u1', 't1', error='timeout')
+        self.assertEqual(self.manager.should_process_posts('B', ['1', '2'], 2), ['1', '2'])
+
+        self.manager.set_post_state('B', '1', PostState.FAILED, 'u1', 't1', error='timeout')
+        self.assertEqual(self.manager.should_process_posts('B', ['1', '2'], 2), ['2'])
+
+    def test_retry_count_survives_reload(self):
+        self.manager.set_post_state('B', '1', PostState.FAILED, 'u1', 't1', error='timeout')
+        self.manager.close()
+
+        manager = StateManager(self.state_dir)
+        post = manager.get_board_state('B').posts['1']
+        manager.close()
+        self.assertEqual((post.url, post.title, post.retry_count, post.error_message),
+                         ('u1', 't1', 1, 'timeout'))
+
+    def test_completed_post_is_skipped(self):
+        self.manager.set_post_state('B', '1', PostState.COMPLETED, 'u1', 't1')
+        self.assertFalse(self.manager.should_process_post('B', '1', 3))
+
+
+if __name__ == '__main__':
+    unittest.main()